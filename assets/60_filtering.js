@@ -0,0 +1,177 @@
+/* Filter the counts of the analyses page in the browser, used with CLIENTSIDE_FILTERING=1.
+ *
+ * The count store holds the non-empty cells of the count cube (see client_payload in callbacks.py).
+ * The charts are drawn like the figure templates on the server: the shown figures are kept and only the data of
+ * their traces is replaced.
+ */
+
+// Return the bits of the selected categories and the bounds of the year range
+function selectFilter(store, categories, yearRange) {
+    var bits = 0;
+    (categories || []).forEach(function (category) {
+        bits |= 1 << store.category_bits[category];
+    });
+    var numYears = store.shape[0];
+    var start = Math.min(Math.max(yearRange[0] - store.year_min, 0), numYears);
+    var stop = Math.min(Math.max(yearRange[1] - store.year_min + 1, start), numYears);
+    return {bits: bits, start: start, stop: stop};
+}
+
+// Return a matrix of zeros
+function zeros(rows, columns) {
+    var matrix = [];
+    for (var row = 0; row < rows; row++) {
+        matrix.push(new Array(columns).fill(0));
+    }
+    return matrix;
+}
+
+// Sum the cells of the filter by year and organisation and by category and organisation
+function countYearCategoryOrg(store, filter) {
+    var numOrgs = store.shape[1];
+    var numPatterns = store.shape[3];
+    var yearOrg = zeros(store.shape[0], numOrgs);
+    var categoryOrg = zeros(store.category_labels.length, numOrgs);
+    var cells = store.year_org.cells;
+    var counts = store.year_org.counts;
+    for (var index = 0; index < cells.length; index++) {
+        var pattern = cells[index] % numPatterns;
+        var organisation = Math.floor(cells[index] / numPatterns) % numOrgs;
+        var year = Math.floor(cells[index] / (numPatterns * numOrgs));
+        if (!(pattern & filter.bits) || year < filter.start || year >= filter.stop) {
+            continue;
+        }
+        yearOrg[year][organisation] += counts[index];
+        // A paper counts for each of its categories
+        for (var bit = 0; bit < categoryOrg.length; bit++) {
+            if (pattern >> bit & 1) {
+                categoryOrg[bit][organisation] += counts[index];
+            }
+        }
+    }
+    return {yearOrg: yearOrg, categoryOrg: categoryOrg};
+}
+
+// Sum the cells of the filter by country and organisation
+function countCountryOrg(store, filter) {
+    var numOrgs = store.shape[1];
+    var numCountries = store.shape[2];
+    var numPatterns = store.shape[3];
+    var countryOrg = zeros(numCountries, numOrgs);
+    var cells = store.country.cells;
+    var counts = store.country.counts;
+    for (var index = 0; index < cells.length; index++) {
+        var pattern = cells[index] % numPatterns;
+        var country = Math.floor(cells[index] / numPatterns) % numCountries;
+        var organisation = Math.floor(cells[index] / (numPatterns * numCountries)) % numOrgs;
+        var year = Math.floor(cells[index] / (numPatterns * numCountries * numOrgs));
+        if ((pattern & filter.bits) && year >= filter.start && year < filter.stop) {
+            countryOrg[country][organisation] += counts[index];
+        }
+    }
+    return countryOrg;
+}
+
+// Return a copy of the figure with the data of each trace extended by the object of the same position
+function renderFigure(figure, traceData) {
+    return Object.assign({}, figure, {
+        data: figure.data.map(function (trace, index) {
+            return Object.assign({}, trace, traceData[index]);
+        })
+    });
+}
+
+function sum(values) {
+    return values.reduce(function (total, value) { return total + value; }, 0);
+}
+
+// Fractions of the map tabs, like calc_country_fractions in callbacks.py
+var COUNTRY_FRACTIONS = {
+    CompanyAcademiaFraction: function (academia, collaboration, company) {
+        return 100 / (academia / company + 1);
+    },
+    CompanyCollaborationFraction: function (academia, collaboration, company) {
+        return 100 / (collaboration / company + 1);
+    },
+    CollaborationAcademiaFraction: function (academia, collaboration, company) {
+        return 100 / (academia / collaboration + 1);
+    },
+    CompanyAcademiaCollabFraction: function (academia, collaboration, company) {
+        return 100 / ((academia + collaboration) / (company + collaboration) + 1);
+    }
+};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    filtering: {
+        charts: function (filterState, store, histogram, pie) {
+            var categoryPies = Array.prototype.slice.call(arguments, 4);
+            if (!store || !filterState) {
+                return window.dash_clientside.no_update;
+            }
+            var organisations = store.organisations;
+            var filter = selectFilter(store, filterState.categories, filterState.years);
+            var counts = countYearCategoryOrg(store, filter);
+            // Like a groupby, only keep years with papers
+            var years = [];
+            counts.yearOrg.forEach(function (orgCounts, year) {
+                if (sum(orgCounts) > 0) {
+                    years.push(year);
+                }
+            });
+            var histogramFigure = renderFigure(histogram, histogram.data.map(function (trace) {
+                var organisation = organisations.indexOf(trace.name);
+                return {
+                    x: years.map(function (year) { return year + store.year_min; }),
+                    y: years.map(function (year) { return counts.yearOrg[year][organisation]; })
+                };
+            }));
+            var orgCounts = organisations.map(function (name, organisation) {
+                return sum(counts.yearOrg.map(function (yearCounts) { return yearCounts[organisation]; }));
+            });
+            var pieFigure = renderFigure(pie, pie.data.map(function (trace) {
+                return {values: trace.labels.map(function (label) { return orgCounts[organisations.indexOf(label)]; })};
+            }));
+            var categoryPieFigures = categoryPies.map(function (figure, index) {
+                var column = store.category_pie_values[index];
+                return renderFigure(figure, figure.data.map(function (trace) {
+                    return {
+                        values: trace.labels.map(function (label) {
+                            var categoryCounts = counts.categoryOrg[store.category_labels.indexOf(label)];
+                            return column === 'Total'
+                                ? sum(categoryCounts)
+                                : categoryCounts[organisations.indexOf(column)];
+                        })
+                    };
+                }));
+            });
+            return [histogramFigure, pieFigure].concat(categoryPieFigures);
+        },
+
+        // The map of a newly selected tab shows the current values of the controls
+        map: function (tab, filterState, categories, yearRange, store) {
+            if (!store || !store.map_tabs[tab]) {
+                return window.dash_clientside.no_update;
+            }
+            var settings = store.map_tabs[tab];
+            var countryOrg = countCountryOrg(store, selectFilter(store, categories, yearRange));
+            var academia = store.organisations.indexOf('Academia');
+            var collaboration = store.organisations.indexOf('Collaboration');
+            var company = store.organisations.indexOf('Company');
+            var fraction = COUNTRY_FRACTIONS[settings.color];
+            return renderFigure(settings.figure, settings.figure.data.map(function () {
+                return {
+                    locations: store.country_codes,
+                    z: countryOrg.map(function (orgCounts) {
+                        var value = fraction(orgCounts[academia], orgCounts[collaboration], orgCounts[company]);
+                        // NaN is not valid JSON, the server sends it as null
+                        return isNaN(value) ? null : value;
+                    }),
+                    hovertext: store.country_names,
+                    customdata: countryOrg.map(function (orgCounts) {
+                        return [orgCounts[academia], orgCounts[company], orgCounts[collaboration]];
+                    })
+                };
+            }));
+        }
+    }
+});
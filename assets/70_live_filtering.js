@@ -0,0 +1,34 @@
+/* Debounce the filter controls of the analyses page.
+ *
+ * The filter state is only set once the controls did not change for the delay. Every filter is numbered,
+ * so that the server can drop the computations of filters which were already superseded.
+ */
+
+var liveFiltering = {
+    // Identifies this page in the filter states, the numbers of different pages are independent
+    client: Math.random().toString(36).slice(2),
+    sequence: 0
+};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    live: {
+        debounce: function (categories, yearRange, delay) {
+            var sequence = ++liveFiltering.sequence;
+            return new Promise(function (resolve) {
+                setTimeout(function () {
+                    // A newer change of the controls sets the filter state itself
+                    if (sequence !== liveFiltering.sequence) {
+                        resolve(window.dash_clientside.no_update);
+                        return;
+                    }
+                    resolve({
+                        client: liveFiltering.client,
+                        sequence: sequence,
+                        categories: categories || [],
+                        years: yearRange
+                    });
+                }, delay);
+            });
+        }
+    }
+});
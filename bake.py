@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Bake the aggregates of all filters of the analyses page into one file."""
+
+# Run `python bake.py` after the dataset changed, e.g. during the build of the deployment.
+# For every combination of research categories the counts are summed over the years, so that the aggregates of any
+# year range are the difference of two slices. The server uses the file instead of the dataset as long as it belongs
+# to the dataset, afterwards a random sample of filters is compared to the charts computed from the papers.
+
+import argparse
+import functools
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cache import file_digest
+from constants import BAKED_AGGREGATES_PATH, DATASET_PATH, RESEARCH_CATEGORIES
+from cube import NUM_PATTERNS, BakedCountCube
+from data_access import category_mask, get_dataset
+
+
+def dataset_axes(data):
+    """Return the years, organisations, country codes and country names which are the axes of the counts."""
+    years = np.arange(data['PY'].min(), data['PY'].max() + 1).astype(data['PY'].dtype)
+    organisations = pd.Categorical(data['Organisation']).categories
+    country_codes = pd.Categorical(data['CountryCode']).categories
+    country_names = data[['CountryCode', 'Country']].dropna().drop_duplicates('CountryCode').set_index(
+        'CountryCode')['Country'].reindex(country_codes)
+    return years, organisations, country_codes, country_names
+
+
+def bake_categories(bits):
+    """Count the papers in at least one of the categories of the bits by year, organisation, category and country."""
+    data = get_dataset()
+    years, organisations, country_codes, _country_names = dataset_axes(data)
+    selected = np.zeros(len(data), dtype=bool)
+    for bit, category in enumerate(RESEARCH_CATEGORIES):
+        if bits >> bit & 1:
+            selected |= category_mask(data, category)
+    papers = data[selected]
+    year = papers['PY'].to_numpy().astype(np.int64) - int(years[0])
+    organisation = pd.Categorical(papers['Organisation'], categories=organisations).codes.astype(np.int64)
+    country = pd.Categorical(papers['CountryCode'], categories=country_codes).codes.astype(np.int64)
+    shape = (len(years), len(organisations))
+    year_org_counts = np.bincount(year * shape[1] + organisation, minlength=np.prod(shape)).reshape(shape)
+    category_counts = np.stack([
+        np.bincount(
+            (year * shape[1] + organisation)[category_mask(papers, category)],
+            minlength=np.prod(shape)
+        ).reshape(shape)
+        for category in RESEARCH_CATEGORIES
+    ], axis=1)
+    # Papers without a country are left out
+    has_country = country >= 0
+    country_shape = (len(years), len(country_codes), len(organisations))
+    country_counts = np.bincount(
+        np.ravel_multi_index((year, country, organisation), country_shape, mode='clip')[has_country],
+        minlength=np.prod(country_shape)
+    ).reshape(country_shape)
+    return year_org_counts, category_counts, country_counts
+
+
+def cumulate(counts):
+    """Sum the counts over the years (the second axis), starting with zero before the first year."""
+    return np.concatenate([np.zeros_like(counts[:, :1]), counts.cumsum(axis=1)], axis=1)
+
+
+def bake(path, workers):
+    """Count the papers of all combinations of categories on all cores and write them to the file."""
+    # Load the dataset before the worker processes are forked, so that they share it
+    years, organisations, country_codes, country_names = dataset_axes(get_dataset())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        year_org_counts, category_counts, country_counts = (
+            np.stack(counts) for counts in zip(*executor.map(bake_categories, range(NUM_PATTERNS)))
+        )
+    # np.savez adds the extension, the file is written next to the target and moved into place
+    temp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(
+        temp_path,
+        version=np.str_(file_digest(DATASET_PATH)),
+        years=years,
+        organisations=organisations.to_numpy(dtype=str),
+        country_codes=country_codes.to_numpy(dtype=str),
+        country_names=country_names.to_numpy(dtype=str),
+        year_org_counts=year_org_counts.astype(np.uint32),
+        cumulative_category_counts=cumulate(category_counts).astype(np.uint32),
+        cumulative_country_counts=cumulate(country_counts).astype(np.uint32)
+    )
+    os.replace(temp_path, path)
+
+
+def all_filters(year_min, year_max):
+    """Return the filters of all non-empty combinations of categories and all year ranges."""
+    return [
+        ([category for bit, category in enumerate(RESEARCH_CATEGORIES) if bits >> bit & 1], (first, last))
+        for bits in range(1, NUM_PATTERNS)
+        for first in range(year_min, year_max + 1)
+        for last in range(first, year_max + 1)
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def load_baked(path):
+    """Return the baked counts, they are loaded once per process."""
+    return BakedCountCube(path)
+
+
+def validate_filter(path, filter_categories, year_range):
+    """Return the names of the aggregates of the baked file which differ from the ones computed from the papers."""
+    # The reference implementation of the live path
+    import callbacks
+    baked = load_baked(path)
+    dff = callbacks.filter_dataframe(filter_categories, year_range)
+    comparisons = {
+        'year-org': (baked.year_org_count(filter_categories, year_range), callbacks.count_year_org(dff)),
+        'org': (baked.org_count(filter_categories, year_range), callbacks.count_org(dff)),
+        'category-org': (baked.category_org_count(filter_categories, year_range), callbacks.count_category_org(dff)),
+        'country-org': (
+            callbacks.calc_country_fractions(baked.country_org_count(filter_categories, year_range)),
+            callbacks.calc_country_org_count(dff)
+        )
+    }
+    differences = []
+    for name, (baked_frame, reference_frame) in comparisons.items():
+        try:
+            # The category order of the country names does not matter for the charts
+            pd.testing.assert_frame_equal(baked_frame, reference_frame, check_categorical=False)
+        except AssertionError:
+            differences.append(name)
+    return differences
+
+
+def validate(path, filters, workers):
+    """Print the filters whose baked aggregates differ from the live path and return whether all of them match."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            validate_filter,
+            *zip(*[(path, filter_categories, year_range) for filter_categories, year_range in filters]),
+            chunksize=max(len(filters) // (4 * workers), 1)
+        )
+        mismatches = [
+            (filter_categories, year_range, differences)
+            for (filter_categories, year_range), differences in zip(filters, results)
+            if differences
+        ]
+    for filter_categories, year_range, differences in mismatches:
+        print(f'{"+".join(filter_categories)} {year_range[0]}-{year_range[1]} differs: {", ".join(differences)}')
+    print(f'validated {len(filters)} filters, {len(mismatches)} differ')
+    return not mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', default=BAKED_AGGREGATES_PATH, help='path of the baked file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--validate', type=int, default=200, help='number of random filters to validate, 0 for none')
+    parser.add_argument('--validate-all', action='store_true', help='validate every filter')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    bake(args.output, args.workers)
+    print(f'baked {args.output} in {time.perf_counter() - start:.1f} s')
+    cube = load_baked(args.output)
+    filters = all_filters(cube.year_min, cube.year_max)
+    if not args.validate_all:
+        filters = random.sample(filters, min(args.validate, len(filters)))
+    if filters and not validate(args.output, filters, args.workers):
+        sys.exit(1)
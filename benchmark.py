@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the chart generation of the Dash application."""
+
+# Run this benchmark with `python benchmark.py figures` to compare drawing the charts with plotly.express
+# to filling the figure templates.
+# Run `python benchmark.py startup --max-seconds 3` (e.g. in CI) to measure how long a fresh process takes
+# to serve the layout and to be ready.
+# Run `python benchmark.py live` to check that the server answers live filter updates within the latency targets.
+# Run `python benchmark.py suite` to measure the hot paths of the callbacks on mixes of filters and on copies of the
+# dataset with 1, 10 and 100 times the rows. The results are saved by commit, `--compare` prints the changes.
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+import callbacks
+import data_access
+from constants import RESEARCH_CATEGORIES
+
+# Representative filters: the default view, a single category and a narrow selection
+FILTERS = [
+    (RESEARCH_CATEGORIES, (1990, 2018)),
+    (['Technology'], (1990, 2018)),
+    (['SocialSciences', 'ArtsHumanities'], (2010, 2015))
+]
+
+
+def filter_name(filter_categories):
+    """Return a short name of the selected categories."""
+    if set(filter_categories) == set(RESEARCH_CATEGORIES):
+        return 'all categories'
+    return '+'.join(filter_categories)
+
+
+# Measured in a fresh interpreter: the time until the layout is served and until the warm-up has finished
+STARTUP_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+import index
+client = index.server.test_client()
+assert client.get('/_dash-layout').status_code == 200
+layout_seconds = time.perf_counter() - start
+while client.get('/ready').status_code != 200:
+    time.sleep(0.01)
+print(json.dumps({'layout_seconds': layout_seconds, 'ready_seconds': time.perf_counter() - start}))
+'''
+
+
+# Latency targets in milliseconds by percentile: the time the server needs to answer all requests of one live update
+# of the filter with empty chart caches. Updates need to stay well below the debounce of the filter controls.
+LIVE_LATENCY_TARGETS_MS = {50: 30, 95: 60}
+
+
+# Number of rows of the synthetic datasets of the suite, in multiples of the dataset
+SUITE_SCALES = [1, 10, 100]
+# Relative slowdown of the median which the comparison of two suite results reports as a regression
+REGRESSION_THRESHOLD = 0.1
+SUITE_RESULTS_DIR = 'benchmark_results'
+
+
+def time_call(func, repeat):
+    """Return the median duration of the function in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def figure_cases(filter_categories, year_range):
+    """Return the charts of a filter with their plotly.express and template functions."""
+    cube = callbacks.get_count_cube()
+    year_org_count = cube.year_org_count(filter_categories, year_range)
+    org_count = cube.org_count(filter_categories, year_range)
+    category_org_count = cube.category_org_count(filter_categories, year_range)
+    map_data = callbacks.compute_map_data(filter_categories, year_range)
+    return {
+        'histogram': (
+            lambda: callbacks.draw_histogram(year_org_count).to_plotly_json(),
+            lambda: callbacks.render_histogram(year_org_count)
+        ),
+        'pie': (
+            lambda: callbacks.draw_pie(org_count).to_plotly_json(),
+            lambda: callbacks.render_pie(org_count)
+        ),
+        'category pies': (
+            lambda: [fig.to_plotly_json() for fig in callbacks.draw_category_pies(category_org_count)],
+            lambda: callbacks.render_category_pies(category_org_count)
+        ),
+        'map': (
+            lambda: callbacks.draw_choropleth(map_data, 'comp-acad-collab').to_plotly_json(),
+            lambda: callbacks.render_choropleth(map_data, 'comp-acad-collab')
+        )
+    }
+
+
+def benchmark_figures(repeat):
+    """Print the median durations of both ways to draw each chart."""
+    print(f'{"filter":<45} {"chart":<15} {"express ms":>11} {"template ms":>12} {"speedup":>8}')
+    for filter_categories, year_range in FILTERS:
+        name = f'{filter_name(filter_categories)} {year_range[0]}-{year_range[1]}'
+        for chart, (express, template) in figure_cases(filter_categories, year_range).items():
+            # Build the template outside of the measurement
+            template()
+            express_ms = time_call(express, repeat)
+            template_ms = time_call(template, repeat)
+            print(f'{name[:45]:<45} {chart:<15} {express_ms:>11.2f} {template_ms:>12.2f} '
+                  f'{express_ms / template_ms:>7.0f}x')
+
+
+def benchmark_startup(repeat, max_seconds):
+    """Print the median start-up times and return False if serving the layout takes longer than allowed."""
+    results = [
+        json.loads(subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout.splitlines()[-1])
+        for _ in range(repeat)
+    ]
+    layout_seconds = statistics.median(result['layout_seconds'] for result in results)
+    ready_seconds = statistics.median(result['ready_seconds'] for result in results)
+    print(f'layout served after {layout_seconds:.2f} s, ready after {ready_seconds:.2f} s')
+    return max_seconds is None or layout_seconds <= max_seconds
+
+
+def clear_chart_caches():
+    """Empty the chart caches in memory, so that the charts are computed again."""
+    for cache in callbacks.chart_caches:
+        if hasattr(cache, 'clear'):
+            cache.clear()
+
+
+def update_request(outputs, inputs, state=()):
+    """Return the body of a Dash callback request for the outputs given as (id, property) tuples."""
+    def prop_id(id_and_property):
+        return '.'.join(id_and_property)
+
+    def value(id_and_property, prop_value=None):
+        return {'id': id_and_property[0], 'property': id_and_property[1], 'value': prop_value}
+
+    return {
+        'output': prop_id(outputs[0]) if len(outputs) == 1 else '..' + '...'.join(map(prop_id, outputs)) + '..',
+        'outputs': value(outputs[0]) if len(outputs) == 1 else [value(output) for output in outputs],
+        'inputs': [value(input_id, prop_value) for input_id, prop_value in inputs],
+        'state': [value(state_id, prop_value) for state_id, prop_value in state],
+        'changedPropIds': [prop_id(input_id) for input_id, _prop_value in inputs]
+    }
+
+
+def live_filter_state(sequence, filter_categories, year_range):
+    """Return the filter state which the browser sends as the filter with the number of a live update."""
+    return {
+        'client': 'benchmark',
+        'sequence': sequence,
+        'categories': filter_categories,
+        'years': list(year_range)
+    }
+
+
+def live_update(client, filter_state):
+    """Send the requests of one live update of the filter, like the browser, and return the responses."""
+    filter_input = [(('filter-state', 'data'), filter_state)]
+    responses = [
+        client.post('/_dash-update-component', json=update_request(outputs, filter_input))
+        for outputs in [
+            [('histogram-year', 'figure')],
+            [('pie-org', 'figure')],
+            [('map-data', 'children')],
+            [(graph_id, 'figure') for graph_id in callbacks.CATEGORY_PIE_GRAPHS]
+        ]
+    ]
+    # The new map data triggers drawing the map
+    map_key = responses[2].get_json()['response']['map-data']['children']
+    responses.append(client.post('/_dash-update-component', json=update_request(
+        [('choropleth-map', 'figure')],
+        [(('map-tabs', 'value'), next(iter(callbacks.MAP_TABS))), (('map-data', 'children'), map_key)]
+    )))
+    return [response.data for response in responses]
+
+
+def random_filter(generator, year_min, year_max):
+    """Return a filter with random categories and a random year range."""
+    first = generator.randint(year_min, year_max)
+    return (
+        generator.sample(RESEARCH_CATEGORIES, generator.randint(1, len(RESEARCH_CATEGORIES))),
+        (first, generator.randint(first, year_max))
+    )
+
+
+def benchmark_live(repeat):
+    """Print the latency percentiles of live updates with random filters and return whether they meet the targets."""
+    import index
+    client = index.server.test_client()
+    callbacks.warmed_up.wait()
+    cube = callbacks.get_count_cube()
+    generator = random.Random(0)
+    durations, num_bytes = [], []
+    for sequence in range(1, repeat + 1):
+        filter_categories, year_range = random_filter(generator, cube.year_min, cube.year_max)
+        filter_state = live_filter_state(sequence, filter_categories, year_range)
+        clear_chart_caches()
+        start = time.perf_counter()
+        num_bytes.append(sum(map(len, live_update(client, filter_state))))
+        durations.append((time.perf_counter() - start) * 1000)
+    percentiles = statistics.quantiles(durations, n=100)
+    passed = True
+    for percentile, target_ms in LIVE_LATENCY_TARGETS_MS.items():
+        latency_ms = percentiles[percentile - 1]
+        passed &= latency_ms <= target_ms
+        print(f'p{percentile}: {latency_ms:.1f} ms (target {target_ms} ms)')
+    print(f'median response size: {statistics.median(num_bytes):.0f} bytes')
+    return passed
+
+
+def filter_mixes(year_min, year_max):
+    """Return representative mixes of filters by name."""
+    generator = random.Random(0)
+    return {
+        'default': [(RESEARCH_CATEGORIES, (year_min, year_max))],
+        'single category': [([category], (year_min, year_max)) for category in RESEARCH_CATEGORIES],
+        'narrow': [
+            (generator.sample(RESEARCH_CATEGORIES, 2), (year, year + 4))
+            for year in range(year_min, year_max - 3, 5)
+        ],
+        'random': [random_filter(generator, year_min, year_max) for _ in range(20)]
+    }
+
+
+def scale_dataset(scale):
+    """Replace the dataset of this process by a synthetic one with copies of its rows.
+
+    The baked aggregates only belong to the dataset file, so the count cube is built from the replacement.
+    """
+    data = data_access.get_dataset()
+    data_access.replace_dataset(pd.concat([data] * scale, ignore_index=True) if scale > 1 else data)
+    callbacks.reset_count_cube()
+
+
+def suite_cases(client, sequences, filter_categories, year_range):
+    """Return the measured functions for a filter, their inputs are prepared outside of the measurement.
+
+    The callbacks are measured as the browser calls them. Every live update gets the next sequence number,
+    so that the server does not drop it as superseded.
+    """
+    dff = callbacks.filter_dataframe(filter_categories, year_range)
+    year_org_count = callbacks.count_year_org(dff)
+    org_count = callbacks.count_org(dff)
+    category_org_count = callbacks.count_category_org(dff)
+    map_request = update_request(
+        [('choropleth-map', 'figure')],
+        [
+            (('map-tabs', 'value'), 'comp-acad'),
+            (('map-data', 'children'), callbacks.encode_filter(filter_categories, year_range))
+        ]
+    )
+    return {
+        'filter_dataframe': lambda: callbacks.filter_dataframe(filter_categories, year_range),
+        'calc_country_org_count': lambda: callbacks.calc_country_org_count(dff),
+        'draw_histogram': lambda: callbacks.draw_histogram(year_org_count),
+        'draw_pie': lambda: callbacks.draw_pie(org_count),
+        'draw_category_pies': lambda: callbacks.draw_category_pies(category_org_count),
+        # The responses are the payload
+        'draw_map': lambda: client.post('/_dash-update-component', json=map_request).data,
+        # All chart callbacks of one change of the filter, the served replacement of create_charts
+        'chart_callbacks': lambda: live_update(
+            client, live_filter_state(next(sequences), filter_categories, year_range))
+    }
+
+
+def payload_size(result):
+    """Return the size of a result in bytes: the memory of data frames and the JSON of everything else."""
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True).sum())
+    if isinstance(result, bytes):
+        return len(result)
+    if isinstance(result, (list, tuple)):
+        return sum(payload_size(item) for item in result)
+    if hasattr(result, 'to_plotly_json'):
+        result = result.to_plotly_json()
+    return len(json.dumps(result, cls=PlotlyJSONEncoder))
+
+
+def traced_peak(func):
+    """Return the peak of the memory allocated while calling the function in bytes."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_suite(scale, repeat):
+    """Measure every case on every filter mix of the scaled dataset and return the results."""
+    # Scale before the warm-up starts, so that it builds the count cube and caches the charts of the scaled dataset
+    scale_dataset(scale)
+    import index
+    client = index.server.test_client()
+    callbacks.warmed_up.wait()
+    clear_chart_caches()
+    cube = callbacks.get_count_cube()
+    sequences = itertools.count(1)
+    # Build the aggregates and the templates and import plotly.express outside of the measurement
+    for func in suite_cases(client, sequences, *callbacks.default_filter()).values():
+        func()
+    results = []
+    for mix, filters in filter_mixes(cube.year_min, cube.year_max).items():
+        samples = {}
+        for filter_categories, year_range in itertools.islice(itertools.cycle(filters), max(repeat, len(filters))):
+            for case, func in suite_cases(client, sequences, filter_categories, year_range).items():
+                clear_chart_caches()
+                start = time.perf_counter()
+                result = func()
+                duration = (time.perf_counter() - start) * 1000
+                samples.setdefault(case, {'durations': [], 'payloads': []})
+                samples[case]['durations'].append(duration)
+                samples[case]['payloads'].append(payload_size(result))
+        # Peak memory is traced on a few filters only, tracing slows the calls down
+        peaks = {}
+        for filter_categories, year_range in filters[:3]:
+            for case, func in suite_cases(client, sequences, filter_categories, year_range).items():
+                clear_chart_caches()
+                peaks[case] = max(peaks.get(case, 0), traced_peak(func))
+        for case, sample in samples.items():
+            percentiles = statistics.quantiles(sample['durations'], n=100, method='inclusive')
+            results.append({
+                'scale': scale,
+                'mix': mix,
+                'case': case,
+                'p50_ms': percentiles[49],
+                'p95_ms': percentiles[94],
+                'p99_ms': percentiles[98],
+                'peak_bytes': peaks[case],
+                'payload_bytes': statistics.median(sample['payloads'])
+            })
+    return results
+
+
+def git_commit():
+    """Return the short hash of the checked out commit, with a suffix if the working tree has changes."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True,
+                                text=True).stdout.strip()
+        changed = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], check=True,
+                                 capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if changed else commit
+
+
+def print_results(results):
+    """Print the results as a table."""
+    print(f'{"scale":>5} {"mix":<16} {"case":<23} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"peak MB":>8} '
+          f'{"payload kB":>10}')
+    for result in results:
+        print(f'{result["scale"]:>4}x {result["mix"]:<16} {result["case"]:<23} {result["p50_ms"]:>9.2f} '
+              f'{result["p95_ms"]:>9.2f} {result["p99_ms"]:>9.2f} {result["peak_bytes"] / 2 ** 20:>8.1f} '
+              f'{result["payload_bytes"] / 1024:>10.1f}')
+
+
+def compare_results(results, baseline_path):
+    """Print the change of the medians to the results of another commit and return whether none regressed."""
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    baseline_results = {(result['scale'], result['mix'], result['case']): result for result in baseline['results']}
+    print(f'compared to {baseline["commit"]}:')
+    passed = True
+    for result in results:
+        before = baseline_results.get((result['scale'], result['mix'], result['case']))
+        if before is None:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1
+        regressed = change > REGRESSION_THRESHOLD
+        passed &= not regressed
+        print(f'{result["scale"]:>4}x {result["mix"]:<16} {result["case"]:<23} {before["p50_ms"]:>9.2f} -> '
+              f'{result["p50_ms"]:>9.2f} ms {change:>+7.0%}{"  REGRESSION" if regressed else ""}')
+    return passed
+
+
+def benchmark_suite(scales, repeat, output, baseline_path):
+    """Run the suite for every scale in a fresh process, save the results and compare them to a baseline."""
+    results = []
+    for scale in scales:
+        # A fresh process per scale, so that the datasets and caches of the scales do not affect each other
+        results.extend(json.loads(subprocess.run(
+            [sys.executable, __file__, 'suite-run', '--scale', str(scale), '--repeat', str(repeat)],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout.splitlines()[-1]))
+    print_results(results)
+    commit = git_commit()
+    output = output or os.path.join(SUITE_RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({
+            'commit': commit,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'repeat': repeat,
+            'results': results
+        }, file, indent=2)
+    print(f'saved results to {output}')
+    return baseline_path is None or compare_results(results, baseline_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    figures_parser = subparsers.add_parser('figures', help='compare plotly.express to the figure templates')
+    figures_parser.add_argument('--repeat', type=int, default=20, help='number of timed calls per measurement')
+    startup_parser = subparsers.add_parser('startup', help='measure the start-up time of the application')
+    startup_parser.add_argument('--repeat', type=int, default=3, help='number of started processes')
+    startup_parser.add_argument('--max-seconds', type=float, help='fail if serving the layout takes longer')
+    live_parser = subparsers.add_parser('live', help='check the latency of live filter updates')
+    live_parser.add_argument('--repeat', type=int, default=200, help='number of random filters')
+    suite_parser = subparsers.add_parser('suite', help='measure the hot paths of the callbacks')
+    suite_parser.add_argument('--scales', type=int, nargs='+', default=SUITE_SCALES,
+                              help='multiples of the rows of the dataset')
+    suite_parser.add_argument('--repeat', type=int, default=20, help='minimum number of calls per filter mix')
+    suite_parser.add_argument('--output', help='path of the results, by default named by the commit')
+    suite_parser.add_argument('--compare', help='results of another commit, fail if a median got slower')
+    suite_run_parser = subparsers.add_parser('suite-run', help='run the suite for one scale in this process')
+    suite_run_parser.add_argument('--scale', type=int, default=1, help='multiple of the rows of the dataset')
+    suite_run_parser.add_argument('--repeat', type=int, default=20, help='minimum number of calls per filter mix')
+    args = parser.parse_args()
+
+    if args.command == 'figures':
+        benchmark_figures(args.repeat)
+    elif args.command == 'startup' and not benchmark_startup(args.repeat, args.max_seconds):
+        sys.exit(1)
+    elif args.command == 'live' and not benchmark_live(args.repeat):
+        sys.exit(1)
+    elif args.command == 'suite' and not benchmark_suite(args.scales, args.repeat, args.output, args.compare):
+        sys.exit(1)
+    elif args.command == 'suite-run':
+        print(json.dumps(run_suite(args.scale, args.repeat)))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Define the server-side caches of the Dash application."""
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def file_version(path):
+    """Identify the version of a file by its size and modification time."""
+    stat = os.stat(path)
+    return hashlib.sha1(f'{stat.st_size}-{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+
+
+def file_digest(path):
+    """Identify the content of a file, which unlike its modification time survives copying it."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def byte_size(value):
+    """Estimate the memory size of a value by its pickled size."""
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class LRUCache:
+    """Least recently used cache which evicts entries once their total size exceeds a number of bytes."""
+
+    def __init__(self, max_bytes):
+        """Create an empty cache."""
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        # Map the keys to tuples of value and size, the most recently used entry is the last one
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the value of the key and mark it as recently used."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def set(self, key, value):
+        """Store the value and evict the least recently used entries until it fits."""
+        size = byte_size(value)
+        with self._lock:
+            if key in self._entries:
+                self.num_bytes -= self._entries.pop(key)[1]
+            # Values that would evict the whole cache are not stored at all
+            if size > self.max_bytes:
+                return
+            while self.num_bytes + size > self.max_bytes:
+                self.num_bytes -= self._entries.popitem(last=False)[1][1]
+            self._entries[key] = (value, size)
+            self.num_bytes += size
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+
+class FileCache:
+    """Cache in a local directory which is shared by all processes using the same directory.
+
+    Every entry is a pickled file named by the hash of its key, so it must only be used with a trusted directory.
+    Files are written atomically, which makes concurrent writers of the same key harmless. Once the directory
+    exceeds its size, the least recently used files are removed in a batch.
+    """
+
+    # Share of the size which is kept when files are removed, so that the directory is not scanned on every write
+    evict_to = 0.75
+
+    def __init__(self, directory, max_bytes):
+        """Create the cache directory if it does not exist yet."""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Size of the directory at the last scan plus the files written by this process since, None before the first
+        # scan. The writes of the other processes are only seen by the next scan.
+        self.num_bytes = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        """Return the file path of the key, which is stable across processes."""
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + '.pickle')
+
+    def get(self, key, default=None):
+        """Return the value of the key and mark it as recently used."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # Missing or (by another process) removed entries are cache misses
+            return default
+        return value
+
+    def set(self, key, value):
+        """Write the value to a temporary file and move it into place."""
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+                size = file.tell()
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        with self._lock:
+            # A replaced file is counted twice, which only brings the next scan forward
+            if self.num_bytes is not None:
+                self.num_bytes += size
+            if self.num_bytes is None or self.num_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Count the bytes of the directory and remove the least recently used files if it exceeds its size."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pickle'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        num_bytes = sum(size for _mtime, size, _path in entries)
+        if num_bytes > self.max_bytes:
+            for _mtime, size, path in sorted(entries):
+                if num_bytes <= self.max_bytes * self.evict_to:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                num_bytes -= size
+        self.num_bytes = num_bytes
+
+
+def get_or_compute(caches, key, compute):
+    """Look the key up in the caches in order, compute it if all of them miss and fill the missing caches."""
+    for index, cache in enumerate(caches):
+        value = cache.get(key)
+        if value is not None:
+            break
+    else:
+        index, value = len(caches), compute()
+    for cache in caches[:index]:
+        cache.set(key, value)
+    return value
@@ -1,64 +1,219 @@
 # -*- coding: utf-8 -*-
 """Define the callbacks of the Dash application."""
 
-from dash.dependencies import Input, Output, State
-import plotly.express as px
-import pandas as pd
+import os
+import threading
+from collections import OrderedDict
+
+from dash import ctx
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from plotly.colors import qualitative
 import numpy as np
+import pandas as pd
 
-from app import app, df
-from constants import COLOR_MAP, LABELS, RESEARCH_CATEGORIES
+import metrics
+from app import app
+from cache import FileCache, LRUCache, file_digest, file_version, get_or_compute
+from constants import (BAKED_AGGREGATES_PATH, CHART_CACHE_MAX_BYTES, CLIENTSIDE_FILTERING, COLOR_MAP,
+                       DATASET_PATH, FILTER_DEBOUNCE_MS, LABELS, LIVE_FILTER_MAX_CLIENTS, METRICS_ENABLED,
+                       RESEARCH_CATEGORIES, SHARED_CACHE_DIR, SHARED_CACHE_MAX_BYTES)
+from cube import BakedCountCube, CountCube, category_bits
+from data_access import category_mask, get_dataset, is_replaced
+from figures import FigureTemplate
 
 # Set alternative color scheme
-color_list = px.colors.qualitative.Antique
+color_list = list(qualitative.Antique)
 # Move grey to fifth position
 color_list.insert(4, color_list.pop(10))
 
+# Count columns shown by the category pie charts, in the order returned by draw_category_pies
+CATEGORY_PIE_VALUES = ['Total', 'Academia', 'Company', 'Collaboration']
+
+# Graphs of the category pie charts, in the order returned by draw_category_pies
+CATEGORY_PIE_GRAPHS = ['pie-cat-all', 'pie-cat-academia', 'pie-cat-companies', 'pie-cat-collaborations']
+
+# Fraction columns of the map data, calculated by calc_country_fractions
+COUNTRY_FRACTION_COLUMNS = [
+    'CompanyAcademiaFraction',
+    'CompanyCollaborationFraction',
+    'CollaborationAcademiaFraction',
+    'CompanyAcademiaCollabFraction'
+]
+
+# Settings of the choropleth map of each map tab
+MAP_TABS = {
+    'comp-acad-collab': {
+        'color': 'CompanyAcademiaCollabFraction',
+        'color_continuous_scale': [(0, COLOR_MAP['Academia']), (1, COLOR_MAP['Company'])],
+        'range_color': [30, 50],
+        'title': 'Company to Academia Publication Fractions (Collab. count for both)',
+        'colorbar_title': 'Company Fraction'
+    },
+    'comp-acad': {
+        'color': 'CompanyAcademiaFraction',
+        'color_continuous_scale': [(0, COLOR_MAP['Academia']), (1, COLOR_MAP['Company'])],
+        'range_color': [0, 20],
+        'title': 'Company to Academia Publication Fractions',
+        'colorbar_title': 'Company Fraction'
+    },
+    'comp-collab': {
+        'color': 'CompanyCollaborationFraction',
+        'color_continuous_scale': [(0, COLOR_MAP['Collaboration']), (1, COLOR_MAP['Company'])],
+        'range_color': [0, 16],
+        'title': 'Company to Collaboration Publication Fractions',
+        'colorbar_title': 'Company Fraction'
+    },
+    'collab-acad': {
+        'color': 'CollaborationAcademiaFraction',
+        'color_continuous_scale': [(0, COLOR_MAP['Academia']), (1, COLOR_MAP['Collaboration'])],
+        'range_color': [40, 100],
+        'title': 'Collaboration to Academia Publication Fractions',
+        'colorbar_title': 'Collabor. Fraction'
+    }
+}
+
+
+# --- COUNT CUBE ---
+
+# Counts of the dataset, built once by the warm-up or by the first callback before
+_count_cube = None
+_count_cube_lock = threading.Lock()
+
+
+def get_count_cube():
+    """Return the counts of the dataset, they are loaded or built on the first call.
+
+    The gunicorn threads of a worker may ask for the counts at the same time, only the first one builds them.
+    """
+    global _count_cube
+    with _count_cube_lock:
+        if _count_cube is None:
+            _count_cube = load_count_cube()
+    return _count_cube
+
+
+def reset_count_cube():
+    """Forget the counts, so that the next call of get_count_cube builds them again, e.g. after replace_dataset."""
+    global _count_cube
+    with _count_cube_lock:
+        _count_cube = None
+
+
+def load_count_cube():
+    """Return the baked counts if they belong to the dataset, otherwise build the count cube."""
+    if os.path.exists(BAKED_AGGREGATES_PATH) and not is_replaced():
+        baked = BakedCountCube(BAKED_AGGREGATES_PATH)
+        if baked.version == file_digest(DATASET_PATH):
+            return baked
+    return CountCube(get_dataset())
+
+
+# --- CHART CACHES ---
+
+# Charts are looked up in memory first, then in the cache shared by all workers (if configured)
+chart_caches = [LRUCache(CHART_CACHE_MAX_BYTES)]
+if SHARED_CACHE_DIR:
+    # A new version of the dataset starts with an empty shared cache
+    chart_caches.append(FileCache(
+        os.path.join(SHARED_CACHE_DIR, file_version(DATASET_PATH)),
+        SHARED_CACHE_MAX_BYTES
+    ))
+
 
 # --- HELPER FUNCTIONS ---
 
+def chart_key(filter_categories, year_range):
+    """Normalise the filter state, so that equal filters share the same charts."""
+    return tuple(sorted(set(filter_categories or []))), (int(year_range[0]), int(year_range[1]))
+
+
+@metrics.span
+def encode_filter(filter_categories, year_range):
+    """Encode the filter as a short key, the categories are the bits of a number."""
+    return f'{category_bits(filter_categories or [])}-{int(year_range[0])}-{int(year_range[1])}'
+
+
+@metrics.span
+def decode_filter(filter_key):
+    """Decode the key of a filter into the normalised filter state."""
+    category_bits, year_min, year_max = (int(value) for value in filter_key.split('-'))
+    filter_categories = [category for bit, category in enumerate(RESEARCH_CATEGORIES) if category_bits >> bit & 1]
+    return chart_key(filter_categories, (year_min, year_max))
+
+
+@metrics.span
 def filter_dataframe(filter_categories, year_range):
-    """Init mask with only False values, add selected categories and filter by year range."""
-    mask = pd.Series(index=df.index, dtype=bool)
+    """Select the papers of the selected categories within the year range.
+
+    The charts are answered by the count cube, the filtered papers are only the reference which bake.py validates the
+    aggregates with. So the masks are built per call and not kept in memory.
+    """
+    data = get_dataset()
+    mask = np.zeros(len(data), dtype=bool)
     for category in filter_categories:
-        mask = mask | df[category].astype(bool)
-    return df[mask & (df['PY'] >= year_range[0]) & (df['PY'] <= year_range[1])]
+        mask |= category_mask(data, category)
+    years = data['PY'].to_numpy()
+    return data[mask & (years >= year_range[0]) & (years <= year_range[1])]
+
+
+def count_year_org(dff):
+    """Count the organisations by year of the filtered papers."""
+    return dff.groupby(['PY', 'Organisation'], observed=False).size().to_frame('Count').reset_index()
+
+
+def count_org(dff):
+    """Count the organisations of the filtered papers."""
+    return dff.groupby(['Organisation'], observed=False).size().to_frame('Count').reset_index()
+
+
+def count_category_org(dff):
+    """Count the organisation type for each category of the filtered papers."""
+    category_org_count = pd.DataFrame({
+        category: category_mask(dff, category) for category in RESEARCH_CATEGORIES
+    }).groupby(dff['Organisation'].array, observed=False).sum().T
+    # Flatten categorical columns
+    category_org_count.columns = category_org_count.columns.tolist()
+    # Set names properly and reset the index
+    category_org_count['Total'] = category_org_count.sum(axis='columns')
+    return category_org_count.reset_index().rename({'index': 'Category'}, axis='columns').replace(LABELS)
+
+
+def calc_country_fractions(counts):
+    """Calculate the fractions of organisations by country in one vectorized pass."""
+    academia, collaboration, company = (
+        counts[organisation].to_numpy(dtype=float) for organisation in ['Academia', 'Collaboration', 'Company']
+    )
+    # Countries without papers of an organisation get NaN or 0 fractions, like with a division of series
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.stack([
+            academia / company,
+            collaboration / company,
+            academia / collaboration,
+            (academia + collaboration) / (company + collaboration)
+        ], axis=1)
+    counts[COUNTRY_FRACTION_COLUMNS] = 100 / (ratios + 1)
+    return counts
 
 
+@metrics.span
 def calc_country_org_count(dff):
     """Calculate the count of organisation by country."""
     # Count of organisation by country
-    counts = dff.groupby(['CountryCode', 'Organisation']).size().unstack()
+    counts = dff.groupby(['CountryCode', 'Organisation'], observed=False).size().unstack()
     # Flatten hierarchical columns
     counts.columns = counts.columns.tolist()
-    # Add country names from dataset
-    counts = counts.merge(
-        dff[['CountryCode', 'Country']],
-        how='left',
-        on='CountryCode'
-    ).drop_duplicates().reset_index(drop=True)
-    # Calculate fractions
-    counts['CompanyAcademiaFraction'] = 100 / (
-            counts['Academia'] / counts['Company'] + 1)
-    counts['CompanyCollaborationFraction'] = 100 / (
-            counts['Collaboration'] / counts['Company'] + 1)
-    counts['CollaborationAcademiaFraction'] = 100 / (
-            counts['Academia'] / counts['Collaboration'] + 1)
-    counts['CompanyAcademiaCollabFraction'] = 100 / ((
-            counts['Academia'] +
-            counts['Collaboration']
-        ) / (
-            counts['Company'] +
-            counts['Collaboration']
-        ) + 1)
-    return counts
+    counts = counts.reset_index()
+    # Look the country names up in the precomputed table instead of merging with the papers
+    counts['Country'] = get_count_cube().country_names.reindex(counts['CountryCode']).values
+    return calc_country_fractions(counts)
 
 
-def draw_histogram(dff):
+@metrics.span
+def draw_histogram(year_org_count):
     """Draw the histogram chart."""
-    # Count of organisation by year
-    year_org_count = pd.DataFrame({'Count': dff.groupby(['PY', 'Organisation']).size()}).reset_index()
-
+    # plotly.express is slow to import, it is only needed once the figure templates are built
+    import plotly.express as px
     fig = px.bar(
         year_org_count,
         x='PY',
@@ -74,11 +229,10 @@ def draw_histogram(dff):
     return fig
 
 
-def draw_pie(dff):
+@metrics.span
+def draw_pie(org_count):
     """Draw the pie chart."""
-    # Count of organisation
-    org_count = pd.DataFrame({'Count': dff.groupby(['Organisation']).size()}).reset_index()
-
+    import plotly.express as px
     fig = px.pie(
         org_count,
         values='Count',
@@ -92,19 +246,10 @@ def draw_pie(dff):
     return fig
 
 
-def draw_category_pies(dff):
+@metrics.span
+def draw_category_pies(category_org_count):
     """Draw the category pie charts."""
-    # Count of organisation type for each category
-    category_org_count = dff[[
-        *RESEARCH_CATEGORIES,
-        'Organisation'
-    ]].replace(0, np.nan).groupby('Organisation').agg('count').T
-    # Flatten categorical columns
-    category_org_count.columns = category_org_count.columns.tolist()
-    # Set names properly and reset the index
-    category_org_count['Total'] = category_org_count.sum(axis='columns')
-    category_org_count = category_org_count.reset_index().rename({'index': 'Category'}, axis='columns').replace(LABELS)
-
+    import plotly.express as px
     pie_cat_all = px.pie(
         category_org_count,
         values='Total',
@@ -158,35 +303,27 @@ def draw_category_pies(dff):
     return [pie_cat_all, pie_cat_academia, pie_cat_companies, pie_cat_collaborations]
 
 
-# --- CALLBACKS ---
-
-@app.callback(Output('choropleth-map', 'figure'),
-              Input('map-tabs', 'value'),
-              Input('map-data', 'children'))
-def draw_map(tab, counts_json):
-    """Draw the four different choropleth maps."""
-    # Import jsonified saved map-data
-    country_org_count = pd.read_json(counts_json, orient='split')
-
-    choro_map_comp_acad = px.choropleth(
+@metrics.span
+def draw_choropleth(country_org_count, tab):
+    """Draw the choropleth map of a tab."""
+    import plotly.express as px
+    settings = MAP_TABS[tab]
+    fig = px.choropleth(
         country_org_count,
         locations='CountryCode',
-        color='CompanyAcademiaFraction',
+        color=settings['color'],
         hover_name='Country',
         hover_data=['Academia', 'Company', 'Collaboration'],
         labels=LABELS,
-        color_continuous_scale=[
-            (0, COLOR_MAP['Academia']),
-            (1, COLOR_MAP['Company'])
-        ],
-        range_color=[0, 20],
-        title='Company to Academia Publication Fractions',
+        color_continuous_scale=settings['color_continuous_scale'],
+        range_color=settings['range_color'],
+        title=settings['title'],
         center={'lat': 20}
     ).update_layout(
         title_x=0.5,
         height=800,
         coloraxis_colorbar=dict(
-            title='Company Fraction',
+            title=settings['colorbar_title'],
             ticks='outside',
             ticksuffix='%'
         )
@@ -197,122 +334,397 @@ def draw_map(tab, counts_json):
         showcoastlines=True,
         projection_type='natural earth'
     )
+    return fig
 
-    choro_map_comp_collab = px.choropleth(
-        country_org_count,
-        locations='CountryCode',
-        color='CompanyCollaborationFraction',
-        hover_name='Country',
-        hover_data=['Academia', 'Company', 'Collaboration'],
-        labels=LABELS,
-        color_continuous_scale=[
-            (0, COLOR_MAP['Collaboration']),
-            (1, COLOR_MAP['Company'])
-        ],
-        range_color=[0, 16],
-        title='Company to Collaboration Publication Fractions',
-        center={'lat': 20}
-    ).update_layout(
-        title_x=0.5,
-        height=800,
-        coloraxis_colorbar=dict(
-            title='Company Fraction',
-            ticks='outside',
-            ticksuffix='%'
-        )
-    ).update_geos(
-        visible=False,
-        showland=True,
-        landcolor='#ccc',
-        showcoastlines=True,
-        projection_type='natural earth'
-    )
 
-    choro_map_collab_acad = px.choropleth(
-        country_org_count,
-        locations='CountryCode',
-        color='CollaborationAcademiaFraction',
-        hover_name='Country',
-        hover_data=['Academia', 'Company', 'Collaboration'],
-        labels=LABELS,
-        color_continuous_scale=[
-            (0, COLOR_MAP['Academia']),
-            (1, COLOR_MAP['Collaboration'])
-        ],
-        range_color=[40, 100],
-        title='Collaboration to Academia Publication Fractions',
-        center={'lat': 20}
-    ).update_layout(
-        title_x=0.5,
-        height=800,
-        coloraxis_colorbar=dict(
-            title='Collabor. Fraction',
-            ticks='outside',
-            ticksuffix='%'
-        )
-    ).update_geos(
-        visible=False,
-        showland=True,
-        landcolor='#ccc',
-        showcoastlines=True,
-        projection_type='natural earth'
-    )
+# --- FIGURE TEMPLATES ---
 
-    choro_map_comp_acad_collab = px.choropleth(
-        country_org_count,
-        locations='CountryCode',
-        color='CompanyAcademiaCollabFraction',
-        hover_name='Country',
-        hover_data=['Academia', 'Company', 'Collaboration'],
-        labels=LABELS,
-        color_continuous_scale=[
-            (0, COLOR_MAP['Academia']),
-            (1, COLOR_MAP['Company'])
-        ],
-        range_color=[30, 50],
-        title='Company to Academia Publication Fractions (Collab. count for both)',
-        center={'lat': 20}
-    ).update_layout(
-        title_x=0.5,
-        height=800,
-        coloraxis_colorbar=dict(
-            title='Company Fraction',
-            ticks='outside',
-            ticksuffix='%'
-        )
-    ).update_geos(
-        visible=False,
-        showland=True,
-        landcolor='#ccc',
-        showcoastlines=True,
-        projection_type='natural earth'
+def default_filter():
+    """Return the filter with all categories and the whole year range."""
+    return RESEARCH_CATEGORIES, (get_count_cube().year_min, get_count_cube().year_max)
+
+
+# Category pie charts of the default filter, drawn once for all four templates
+_default_category_pies = None
+_default_category_pies_lock = threading.Lock()
+
+
+def default_category_pies():
+    """Draw the category pie charts of the default filter, the skeletons of all four templates.
+
+    The four templates share them, so they are drawn once even if the templates are built at the same time.
+    """
+    global _default_category_pies
+    with _default_category_pies_lock:
+        if _default_category_pies is None:
+            _default_category_pies = draw_category_pies(get_count_cube().category_org_count(*default_filter()))
+    return _default_category_pies
+
+
+# The skeletons are drawn once with plotly.express from the counts of the default filter
+histogram_template = FigureTemplate(
+    lambda: draw_histogram(get_count_cube().year_org_count(*default_filter())),
+    ['x', 'y']
+)
+pie_template = FigureTemplate(
+    lambda: draw_pie(get_count_cube().org_count(*default_filter())),
+    ['values']
+)
+category_pie_templates = [
+    FigureTemplate(
+        lambda index=index: default_category_pies()[index],
+        ['values']
     )
+    for index in range(len(CATEGORY_PIE_VALUES))
+]
+choropleth_templates = {
+    tab: FigureTemplate(
+        lambda tab=tab: draw_choropleth(cached_chart('map-data', compute_map_data, *default_filter()), tab),
+        ['locations', 'z', 'hovertext', 'customdata']
+    )
+    for tab in MAP_TABS
+}
+
+
+def values_by_label(trace, counts, label_column, value_column):
+    """Return the values of the counts in the order of the labels of a pie trace."""
+    return counts.set_index(label_column)[value_column].reindex(trace['labels'], fill_value=0).to_numpy()
+
+
+@metrics.span
+def render_histogram(year_org_count):
+    """Draw the histogram chart by filling its template with the counts."""
+    organisations = year_org_count['Organisation'].to_numpy()
+    return histogram_template.render([
+        {
+            'x': year_org_count['PY'].to_numpy()[organisations == trace['name']],
+            'y': year_org_count['Count'].to_numpy()[organisations == trace['name']]
+        }
+        for trace in histogram_template.traces
+    ])
+
+
+@metrics.span
+def render_pie(org_count):
+    """Draw the pie chart by filling its template with the counts."""
+    return pie_template.render([
+        {'values': values_by_label(trace, org_count, 'Organisation', 'Count')}
+        for trace in pie_template.traces
+    ])
+
+
+@metrics.span
+def render_category_pies(category_org_count):
+    """Draw the category pie charts by filling their templates with the counts."""
+    return [
+        template.render([
+            {'values': values_by_label(trace, category_org_count, 'Category', value_column)}
+            for trace in template.traces
+        ])
+        for template, value_column in zip(category_pie_templates, CATEGORY_PIE_VALUES)
+    ]
+
+
+@metrics.span
+def render_choropleth(country_org_count, tab):
+    """Draw the choropleth map of a tab by filling its template with the map data."""
+    template = choropleth_templates[tab]
+    return template.render([
+        {
+            'locations': country_org_count['CountryCode'].to_numpy(dtype=object),
+            'z': country_org_count[MAP_TABS[tab]['color']].to_numpy(),
+            'hovertext': country_org_count['Country'].to_numpy(dtype=object),
+            'customdata': country_org_count[['Academia', 'Company', 'Collaboration']].to_numpy()
+        }
+        for _trace in template.traces
+    ])
+
+
+@metrics.span
+def compute_histogram(filter_categories, year_range):
+    """Compute the histogram chart of the filter."""
+    # Only slices of the precomputed count cube are summed, the papers themselves are not touched
+    return render_histogram(get_count_cube().year_org_count(filter_categories, year_range))
+
+
+@metrics.span
+def compute_pie(filter_categories, year_range):
+    """Compute the pie chart of the filter."""
+    return render_pie(get_count_cube().org_count(filter_categories, year_range))
+
+
+@metrics.span
+def compute_category_pies(filter_categories, year_range):
+    """Compute the category pie charts of the filter."""
+    return render_category_pies(get_count_cube().category_org_count(filter_categories, year_range))
+
+
+def cached_chart(name, compute, filter_categories, year_range):
+    """Return the chart (group) of the filter from the chart caches or compute it."""
+    key = chart_key(filter_categories, year_range)
+    return get_or_compute(chart_caches, (name, *key), lambda: compute(*key))
+
+
+@metrics.span
+def compute_map_data(filter_categories, year_range):
+    """Compute the count and fractions of organisations by country of the filter."""
+    return calc_country_fractions(get_count_cube().country_org_count(filter_categories, year_range))
+
+
+def map_figure(tab, filter_categories, year_range):
+    """Return the choropleth map of a tab and filter from the chart caches or compute it."""
+    key = chart_key(filter_categories, year_range)
+    return get_or_compute(chart_caches, ('map', tab, *key), lambda: render_choropleth(
+        cached_chart('map-data', compute_map_data, *key),
+        tab
+    ))
 
-    if tab == 'comp-acad-collab':
-        return choro_map_comp_acad_collab
-    elif tab == 'comp-acad':
-        return choro_map_comp_acad
-    elif tab == 'comp-collab':
-        return choro_map_comp_collab
-    elif tab == 'collab-acad':
-        return choro_map_collab_acad
-
-
-@app.callback(Output('histogram-year', 'figure'),
-              Output('pie-org', 'figure'),
-              Output('map-data', 'children'),
-              Output('pie-cat-all', 'figure'),
-              Output('pie-cat-academia', 'figure'),
-              Output('pie-cat-companies', 'figure'),
-              Output('pie-cat-collaborations', 'figure'),
-              Input('submit-button-state', 'n_clicks'),
-              State('category-filter', 'value'),
-              State('year-slider', 'value'))
-def create_charts(_n_clicks, filter_categories, year_range):
-    """Calls functions for creating/updating charts and outputs them."""
-    del _n_clicks  # n_clicks is only used for triggering this function
-    dff = filter_dataframe(filter_categories, year_range)
-    return (draw_histogram(dff),
-            draw_pie(dff),
-            calc_country_org_count(dff).to_json(orient='split'),
-            *draw_category_pies(dff))
+
+# --- LIVE FILTERING ---
+
+class FilterSequences:
+    """Latest filter of each browser, so that the computations of filters which were superseded are dropped.
+
+    The browser numbers its filters (see assets/70_live_filtering.js). Each worker process only knows the filters
+    it received itself, so a superseded filter which reaches another worker is still computed.
+    """
+
+    def __init__(self, max_clients):
+        """Create an empty record, only the most recently active browsers are remembered."""
+        self.max_clients = max_clients
+        self._latest = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_superseded(self, client, sequence):
+        """Record the filter of the browser and return whether a newer one was already received."""
+        with self._lock:
+            latest = max(self._latest.pop(client, sequence), sequence)
+            self._latest[client] = latest
+            while len(self._latest) > self.max_clients:
+                self._latest.popitem(last=False)
+        return sequence < latest
+
+
+filter_sequences = FilterSequences(LIVE_FILTER_MAX_CLIENTS)
+
+
+def live_filter(filter_state):
+    """Return the categories and year range of the filter state, unless the browser already sent a newer filter."""
+    try:
+        client, sequence = filter_state['client'], int(filter_state['sequence'])
+        filter_categories, year_range = filter_state['categories'], filter_state['years']
+    except (TypeError, KeyError, ValueError):
+        raise PreventUpdate
+    if filter_sequences.is_superseded(client, sequence):
+        raise PreventUpdate
+    return filter_categories or [], year_range
+
+
+def observe_filter(name, filter_categories, year_range):
+    """Record the number of papers selected by the filter of a served callback, if the metrics are enabled."""
+    if METRICS_ENABLED:
+        # A slice of the count cube, also if the charts come from the caches
+        metrics.observe_rows(name, int(get_count_cube().org_count(filter_categories, year_range)['Count'].sum()))
+
+
+# --- CLIENTSIDE FILTERING ---
+
+def client_payload():
+    """Return the non-empty cells of the count cube and the map skeletons, from which the browser draws the charts."""
+    cube = get_count_cube()
+    if not isinstance(cube, CountCube):
+        # The baked counts only hold the sums of the category combinations, the browser needs the patterns
+        cube = CountCube(get_dataset())
+    cells = cube.nonzero_cells()
+    return {
+        'year_min': cube.year_min,
+        # Shape of the country cells, the year and organisation cells leave out the countries
+        'shape': [cube.shape[0], cube.shape[1], len(cube.country_codes), cube.shape[3]],
+        'category_bits': {category: bit for bit, category in enumerate(RESEARCH_CATEGORIES)},
+        'category_labels': [LABELS[category] for category in RESEARCH_CATEGORIES],
+        'category_pie_values': CATEGORY_PIE_VALUES,
+        'organisations': cube.organisations.tolist(),
+        'country_codes': cube.country_codes.tolist(),
+        'country_names': [None if pd.isna(name) else name for name in cube.country_names],
+        **{
+            name: {'cells': indices.tolist(), 'counts': counts.tolist()}
+            for name, (indices, counts) in cells.items()
+        },
+        'map_tabs': {
+            tab: {'color': settings['color'], 'figure': choropleth_templates[tab].figure}
+            for tab, settings in MAP_TABS.items()
+        }
+    }
+
+
+# --- WARM-UP ---
+
+# Set once the dataset is loaded and the charts of the default filter are cached
+warmed_up = threading.Event()
+
+# Snapshot of the default filter, computed once by the warm-up or by the first page requested before
+_default_snapshot = None
+_default_snapshot_lock = threading.Lock()
+
+
+def default_snapshot():
+    """Return the properties of the analyses page components which show the default filter, by component id.
+
+    Callers wait while another thread computes the snapshot, so it is only computed once.
+    """
+    global _default_snapshot
+    with _default_snapshot_lock:
+        if _default_snapshot is None:
+            _default_snapshot = compute_default_snapshot()
+    return _default_snapshot
+
+
+def compute_default_snapshot():
+    """Compute the properties of the analyses page components which show the default filter."""
+    filter_categories, year_range = default_filter()
+    category_pies = cached_chart('category-pies', compute_category_pies, filter_categories, year_range)
+    return {
+        'histogram-year': {'figure': cached_chart('histogram', compute_histogram, filter_categories, year_range)},
+        'pie-org': {'figure': cached_chart('pie', compute_pie, filter_categories, year_range)},
+        'map-data': {'children': encode_filter(filter_categories, year_range)},
+        # The first tab is selected when the page is shown
+        'choropleth-map': {'figure': map_figure(next(iter(MAP_TABS)), filter_categories, year_range)},
+        **{
+            graph_id: {'figure': figure}
+            for graph_id, figure in zip(CATEGORY_PIE_GRAPHS, category_pies)
+        },
+        **({'count-store': {'data': client_payload()}} if CLIENTSIDE_FILTERING else {})
+    }
+
+
+def warm_up():
+    """Load the aggregates, build the templates and cache the charts of the default filter."""
+    default_snapshot()
+    filter_categories, year_range = default_filter()
+    for tab in MAP_TABS:
+        map_figure(tab, filter_categories, year_range)
+    warmed_up.set()
+
+
+def start_warm_up():
+    """Warm up in a background thread, so that the server already answers requests in the meantime."""
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
+# --- CALLBACKS ---
+
+def chart_callback(*args, **kwargs):
+    """Register a callback of the charts on the server, unless the browser filters the charts itself."""
+    if CLIENTSIDE_FILTERING:
+        return lambda function: function
+    return app.callback(*args, **kwargs)
+
+
+@chart_callback(Output('choropleth-map', 'figure'),
+                Input('map-tabs', 'value'),
+                Input('map-data', 'children'),
+                prevent_initial_call=True)
+@metrics.span
+def draw_map(tab, filter_key):
+    """Draw the choropleth map of the selected tab, the maps of the other tabs are only built when selected."""
+    if tab not in MAP_TABS or not filter_key:
+        raise PreventUpdate
+    try:
+        key = decode_filter(filter_key)
+    except (ValueError, IndexError):
+        raise PreventUpdate
+    observe_filter('draw_map', *key)
+    # Every worker can (re)compute the map data from the key, even if it was created by another worker
+    figure = map_figure(tab, *key)
+    # Only new map data keeps the tab and therefore the layout of the shown map, the tab may change in the same update
+    if 'map-tabs.value' not in ctx.triggered_prop_ids:
+        return choropleth_templates[tab].patch(figure)
+    return figure
+
+
+# Each chart group has its own callback, so that it is computed and shown as soon as it is ready.
+# The analyses page is served with the charts of the default filter (see default_snapshot), so the callbacks
+# only run on changes of the filter and only the trace data of the shown figures changes.
+
+@chart_callback(Output('histogram-year', 'figure'),
+                Input('filter-state', 'data'),
+                prevent_initial_call=True)
+@metrics.span
+def update_histogram(filter_state):
+    """Output the histogram chart of the filter."""
+    filter_categories, year_range = live_filter(filter_state)
+    observe_filter('update_histogram', filter_categories, year_range)
+    figure = cached_chart('histogram', compute_histogram, filter_categories, year_range)
+    return histogram_template.patch(figure)
+
+
+@chart_callback(Output('pie-org', 'figure'),
+                Input('filter-state', 'data'),
+                prevent_initial_call=True)
+@metrics.span
+def update_pie(filter_state):
+    """Output the pie chart of the filter."""
+    filter_categories, year_range = live_filter(filter_state)
+    observe_filter('update_pie', filter_categories, year_range)
+    figure = cached_chart('pie', compute_pie, filter_categories, year_range)
+    return pie_template.patch(figure)
+
+
+@chart_callback(Output('map-data', 'children'),
+                Input('filter-state', 'data'),
+                prevent_initial_call=True)
+@metrics.span
+def update_map_data(filter_state):
+    """Output the key of the map data of the filter, which triggers drawing the map."""
+    filter_categories, year_range = live_filter(filter_state)
+    return encode_filter(filter_categories, year_range)
+
+
+@chart_callback(Output('pie-cat-all', 'figure'),
+                Output('pie-cat-academia', 'figure'),
+                Output('pie-cat-companies', 'figure'),
+                Output('pie-cat-collaborations', 'figure'),
+                Input('filter-state', 'data'),
+                prevent_initial_call=True)
+@metrics.span
+def update_category_pies(filter_state):
+    """Output the category pie charts of the filter."""
+    filter_categories, year_range = live_filter(filter_state)
+    observe_filter('update_category_pies', filter_categories, year_range)
+    figures = cached_chart('category-pies', compute_category_pies, filter_categories, year_range)
+    return [template.patch(figure) for template, figure in zip(category_pie_templates, figures)]
+
+
+# Debounced in the browser, see assets/70_live_filtering.js
+app.clientside_callback(
+    f'(categories, yearRange) => window.dash_clientside.live.debounce(categories, yearRange, {FILTER_DEBOUNCE_MS})',
+    Output('filter-state', 'data'),
+    Input('category-filter', 'value'),
+    Input('year-slider', 'value'),
+    prevent_initial_call=True
+)
+
+if CLIENTSIDE_FILTERING:
+    # The functions are defined in assets/60_filtering.js
+    app.clientside_callback(
+        ClientsideFunction(namespace='filtering', function_name='charts'),
+        Output('histogram-year', 'figure'),
+        Output('pie-org', 'figure'),
+        *[Output(graph_id, 'figure') for graph_id in CATEGORY_PIE_GRAPHS],
+        Input('filter-state', 'data'),
+        State('count-store', 'data'),
+        State('histogram-year', 'figure'),
+        State('pie-org', 'figure'),
+        *[State(graph_id, 'figure') for graph_id in CATEGORY_PIE_GRAPHS],
+        prevent_initial_call=True
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='filtering', function_name='map'),
+        Output('choropleth-map', 'figure'),
+        Input('map-tabs', 'value'),
+        Input('filter-state', 'data'),
+        State('category-filter', 'value'),
+        State('year-slider', 'value'),
+        State('count-store', 'data'),
+        prevent_initial_call=True
+    )
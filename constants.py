@@ -1,12 +1,34 @@
 # -*- coding: utf-8 -*-
 """Define constant strings."""
 
+import os
+
 DATASET_PATH = 'dataset/papers.parquet'
+# Uncompressed copy of the dataset, which all worker processes memory-map
+ARROW_DATASET_PATH = 'dataset/papers.arrow'
+# Either 'parquet' to read the dataset into every worker process or 'mmap' to share the memory-mapped Arrow file
+DATASET_LOAD_MODE = os.environ.get('DATASET_LOAD_MODE', 'parquet')
+# Aggregates of all filters written by `python bake.py`, used instead of the dataset if they belong to it
+BAKED_AGGREGATES_PATH = 'dataset/aggregates.npz'
 PANDASPROFILING_REPORT = 'papers_pandas-profiling-report.html'
 SWEETVIZ_REPORT = 'papers_sweetviz-report.html'
 
 LOADING_TYPE = 'default'
 
+# Maximum size of the charts which are kept in memory for recently used filters
+CHART_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Optional local directory in which all (gunicorn) worker processes share their charts
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR')
+SHARED_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Time in milliseconds the filter controls must stay unchanged before the charts are updated
+FILTER_DEBOUNCE_MS = 150
+# Number of browsers whose latest filter is remembered to drop the computations of superseded filters
+LIVE_FILTER_MAX_CLIENTS = 10000
+# Set to 1 to measure the durations of the hot paths and to serve them at /metrics
+METRICS_ENABLED = os.environ.get('METRICS', '0') == '1'
+# Set to 1 to send the counts to the browser once, which then filters them itself without calling the server
+CLIENTSIDE_FILTERING = os.environ.get('CLIENTSIDE_FILTERING', '0') == '1'
+
 RESEARCH_CATEGORIES = [
     'ArtsHumanities',
     'LifeSciencesBiomedicine',
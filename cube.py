@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Define the precomputed count cube of the papers."""
+
+import numpy as np
+import pandas as pd
+
+from constants import LABELS, RESEARCH_CATEGORIES
+from data_access import category_mask
+
+# Every combination of research categories a paper can belong to
+NUM_PATTERNS = 2 ** len(RESEARCH_CATEGORIES)
+# Bit matrix with one row per pattern and one column per research category
+PATTERN_MEMBERSHIP = (np.arange(NUM_PATTERNS)[:, None] >> np.arange(len(RESEARCH_CATEGORIES))) & 1
+
+
+def year_bounds(year_range, year_min, num_years):
+    """Return the start and stop offsets of the year range on an axis of years starting at year_min."""
+    start = min(max(year_range[0] - year_min, 0), num_years)
+    stop = min(max(year_range[1] - year_min + 1, start), num_years)
+    return start, stop
+
+
+def category_bits(filter_categories):
+    """Return the number whose bits are the selected research categories."""
+    return sum(1 << RESEARCH_CATEGORIES.index(category) for category in set(filter_categories))
+
+
+# --- FRAMES ---
+# The aggregates are returned as the same frames as the groupby of the filtered papers
+
+def year_org_frame(counts, years, organisations, year_dtype):
+    """Return the counts of an array of years by organisations, like a groupby only years with papers are kept."""
+    has_papers = counts.sum(axis=1) > 0
+    counts, years = counts[has_papers], years[has_papers]
+    return pd.DataFrame({
+        'PY': np.repeat(years, len(organisations)).astype(year_dtype),
+        'Organisation': pd.Categorical.from_codes(
+            np.tile(np.arange(len(organisations)), len(years)),
+            categories=organisations
+        ),
+        'Count': counts.ravel().astype(np.int64)
+    })
+
+
+def org_frame(counts, organisations):
+    """Return the counts by organisation."""
+    return pd.DataFrame({
+        'Organisation': pd.Categorical(organisations, categories=organisations),
+        'Count': counts.astype(np.int64)
+    })
+
+
+def category_org_frame(counts, organisations):
+    """Return the counts of an array of research categories by organisations with their totals."""
+    category_org_count = pd.DataFrame(counts.astype(np.int64), columns=organisations.tolist())
+    category_org_count['Total'] = category_org_count.sum(axis='columns')
+    category_org_count.insert(0, 'Category', [LABELS[category] for category in RESEARCH_CATEGORIES])
+    return category_org_count
+
+
+def country_org_frame(counts, organisations, country_codes, country_names):
+    """Return the counts of an array of countries by organisations with the country names."""
+    country_org_count = pd.DataFrame(counts.astype(np.int64), columns=organisations.tolist())
+    country_org_count.insert(0, 'CountryCode', pd.Categorical(country_codes, categories=country_codes))
+    country_org_count['Country'] = country_names.values
+    return country_org_count
+
+
+class CountCube:
+    """Count of papers by year, organisation, country and category membership pattern.
+
+    The cube is built once from the dataset. Every chart of the analyses page can be answered by summing slices of it,
+    so its size only depends on the number of years, organisations and countries and not on the number of papers.
+    """
+
+    def __init__(self, data):
+        """Count the papers of every cell of the cube."""
+        years = data['PY'].to_numpy()
+        self.year_dtype = data['PY'].dtype
+        self.year_min = int(years.min())
+        self.year_max = int(years.max())
+        organisations = pd.Categorical(data['Organisation'])
+        self.organisations = organisations.categories
+        countries = pd.Categorical(data['CountryCode'])
+        self.country_codes = countries.categories
+        # Country names by country code, papers without a country are counted in an extra last slot
+        self.country_names = data[['CountryCode', 'Country']].dropna().drop_duplicates('CountryCode').set_index(
+            'CountryCode')['Country'].reindex(self.country_codes)
+        country = np.where(countries.codes < 0, len(self.country_codes), countries.codes)
+        # Encode the membership of the research categories as bits of the pattern
+        pattern = np.zeros(len(data), dtype=np.int64)
+        for bit, category in enumerate(RESEARCH_CATEGORIES):
+            pattern |= category_mask(data, category).astype(np.int64) << bit
+
+        self.shape = (
+            self.year_max - self.year_min + 1,
+            len(self.organisations),
+            len(self.country_codes) + 1,
+            NUM_PATTERNS
+        )
+        cell = np.ravel_multi_index((years - self.year_min, organisations.codes, country, pattern), self.shape)
+        counts = np.bincount(cell, minlength=np.prod(self.shape)).reshape(self.shape)
+        # Charts without countries only need the counts by year, organisation and pattern
+        self.year_org_counts = counts.sum(axis=2)
+        # Country counts are summed over the years in advance, so that a year range is a difference of two slices
+        self.cumulative_country_counts = np.concatenate([
+            np.zeros((1, *self.shape[1:]), dtype=counts.dtype),
+            counts.cumsum(axis=0)
+        ])[:, :, :-1]
+
+    def select(self, filter_categories, year_range):
+        """Return the bounds of the year range and the patterns that contain at least one of the categories."""
+        selected_bits = [RESEARCH_CATEGORIES.index(category) for category in filter_categories]
+        pattern_mask = PATTERN_MEMBERSHIP[:, selected_bits].any(axis=1)
+        return (*year_bounds(year_range, self.year_min, self.shape[0]), pattern_mask)
+
+    def year_org_count(self, filter_categories, year_range):
+        """Count the papers by year and organisation."""
+        start, stop, pattern_mask = self.select(filter_categories, year_range)
+        return year_org_frame(
+            self.year_org_counts[start:stop][..., pattern_mask].sum(axis=2),
+            np.arange(start, stop) + self.year_min,
+            self.organisations,
+            self.year_dtype
+        )
+
+    def org_count(self, filter_categories, year_range):
+        """Count the papers by organisation."""
+        start, stop, pattern_mask = self.select(filter_categories, year_range)
+        return org_frame(self.year_org_counts[start:stop][..., pattern_mask].sum(axis=(0, 2)), self.organisations)
+
+    def category_org_count(self, filter_categories, year_range):
+        """Count the papers of each research category by organisation."""
+        start, stop, pattern_mask = self.select(filter_categories, year_range)
+        # Papers by organisation and pattern, then add each pattern to all of its categories
+        counts = self.year_org_counts[start:stop].sum(axis=0)[:, pattern_mask] @ PATTERN_MEMBERSHIP[pattern_mask]
+        return category_org_frame(counts.T, self.organisations)
+
+    def country_org_count(self, filter_categories, year_range):
+        """Count the papers by country and organisation and add the country names."""
+        start, stop, pattern_mask = self.select(filter_categories, year_range)
+        counts = (
+            self.cumulative_country_counts[stop] - self.cumulative_country_counts[start]
+        )[..., pattern_mask].sum(axis=2)
+        return country_org_frame(counts.T, self.organisations, self.country_codes, self.country_names)
+
+    def nonzero_cells(self):
+        """Return the flat indices and counts of the non-empty cells, e.g. to send the cube to the browser.
+
+        The cells are returned by year, organisation and pattern and by year, organisation, country and pattern.
+        """
+        country_counts = np.diff(self.cumulative_country_counts, axis=0)
+        return {
+            name: (np.flatnonzero(counts), counts[counts != 0])
+            for name, counts in [('year_org', self.year_org_counts), ('country', country_counts)]
+        }
+
+
+class BakedCountCube:
+    """Counts of papers of every combination of research categories, loaded from the file written by bake.py.
+
+    It answers the same questions as the count cube: the counts are summed over the years in advance, so that every
+    filter is a difference of two slices and neither the dataset nor the cube has to be loaded.
+    """
+
+    def __init__(self, path):
+        """Load the baked counts."""
+        with np.load(path) as baked:
+            self.version = str(baked['version'])
+            years = baked['years']
+            self.organisations = pd.Index(baked['organisations'])
+            self.country_codes = pd.Index(baked['country_codes'])
+            country_names = baked['country_names']
+            # Indexed by the category bits of the filter and by the end of the year range
+            self.year_org_counts = baked['year_org_counts']
+            self.cumulative_category_counts = baked['cumulative_category_counts']
+            self.cumulative_country_counts = baked['cumulative_country_counts']
+        self.year_dtype = years.dtype
+        self.year_min = int(years[0])
+        self.year_max = int(years[-1])
+        self.country_names = pd.Series(pd.Categorical(country_names), index=self.country_codes)
+
+    def select(self, filter_categories, year_range):
+        """Return the bounds of the year range and the bits of the categories."""
+        start, stop = year_bounds(year_range, self.year_min, self.year_org_counts.shape[1])
+        return start, stop, category_bits(filter_categories)
+
+    def year_org_count(self, filter_categories, year_range):
+        """Count the papers by year and organisation."""
+        start, stop, bits = self.select(filter_categories, year_range)
+        return year_org_frame(
+            self.year_org_counts[bits, start:stop],
+            np.arange(start, stop) + self.year_min,
+            self.organisations,
+            self.year_dtype
+        )
+
+    def org_count(self, filter_categories, year_range):
+        """Count the papers by organisation."""
+        start, stop, bits = self.select(filter_categories, year_range)
+        return org_frame(self.year_org_counts[bits, start:stop].sum(axis=0), self.organisations)
+
+    def category_org_count(self, filter_categories, year_range):
+        """Count the papers of each research category by organisation."""
+        start, stop, bits = self.select(filter_categories, year_range)
+        counts = self.cumulative_category_counts[bits, stop] - self.cumulative_category_counts[bits, start]
+        return category_org_frame(counts, self.organisations)
+
+    def country_org_count(self, filter_categories, year_range):
+        """Count the papers by country and organisation and add the country names."""
+        start, stop, bits = self.select(filter_categories, year_range)
+        counts = self.cumulative_country_counts[bits, stop] - self.cumulative_country_counts[bits, start]
+        return country_org_frame(counts, self.organisations, self.country_codes, self.country_names)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Define how the dataset is loaded."""
+
+# Every view of the application declares the columns and publication years it needs,
+# only these columns and the row groups of these years are read.
+# The analyses view is compacted after loading: the research categories become the bits of one byte per paper and
+# the country names share the codes of the country codes, so that a paper takes 6 instead of 47 bytes.
+# The memory-mappable Arrow file is written in this compact layout, so that the workers use its columns as they are.
+# Run `python data_access.py` to convert the dataset to the Arrow file in advance, e.g. during the build of the
+# deployment.
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from constants import ARROW_DATASET_PATH, DATASET_LOAD_MODE, DATASET_PATH, RESEARCH_CATEGORIES
+
+# Columns and year range (None for all years) of the dataset which each view reads
+DATASET_VIEWS = {
+    'analyses': {
+        'columns': ['PY', 'Organisation', 'CountryCode', 'Country', *RESEARCH_CATEGORIES],
+        'year_range': None,
+        'compact': True
+    }
+}
+
+# Bit of each research category in the compact category column
+CATEGORY_BITS = {category: bit for bit, category in enumerate(RESEARCH_CATEGORIES)}
+# Layout of the papers in the Arrow file, files of another layout are converted again
+ARROW_LAYOUT = b'compact'
+
+# Loaded datasets by view
+_datasets = {}
+_dataset_lock = threading.Lock()
+# Views whose dataset was replaced, e.g. by a scaled copy in benchmarks
+_replaced_views = set()
+
+
+def year_filter(year_range):
+    """Return the pyarrow filter expression of the year range, or None for all years."""
+    if year_range is None:
+        return None
+    return (pc.field('PY') >= year_range[0]) & (pc.field('PY') <= year_range[1])
+
+
+def arrow_layout(arrow_path=ARROW_DATASET_PATH):
+    """Return the layout which the Arrow file was written in."""
+    with pa.memory_map(arrow_path, 'r') as source:
+        return (pa.ipc.open_file(source).schema.metadata or {}).get(b'layout')
+
+
+def convert_to_arrow(parquet_path=DATASET_PATH, arrow_path=ARROW_DATASET_PATH):
+    """Convert the parquet dataset to an uncompressed Arrow IPC file in the compact layout, unless it is up to date.
+
+    The papers are stored like compact_dataset keeps them in memory: the research categories as one bit column, the
+    years as uint16 and the organisations and countries dictionary-encoded with the codes of pandas as indices.
+    The columns which compaction does not touch are stored as they are.
+    """
+    if (os.path.exists(arrow_path) and os.path.getmtime(arrow_path) >= os.path.getmtime(parquet_path)
+            and arrow_layout(arrow_path) == ARROW_LAYOUT):
+        return
+    data = pq.read_table(parquet_path).to_pandas()
+    compact = compact_dataset(data)
+    others = data.drop(columns=['PY', 'Organisation', 'CountryCode', 'Country', *RESEARCH_CATEGORIES])
+    # One chunk per column, so that every column can be used without copying it
+    table = pa.Table.from_pandas(
+        pd.concat([compact, others], axis='columns'),
+        preserve_index=False
+    ).combine_chunks().replace_schema_metadata({b'layout': ARROW_LAYOUT})
+    # Workers starting at the same time may convert concurrently, the last complete file wins
+    temp_path = f'{arrow_path}.{os.getpid()}.tmp'
+    with pa.OSFile(temp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(temp_path, arrow_path)
+
+
+def read_parquet(view, parquet_path=DATASET_PATH):
+    """Read the columns of the view, row groups outside of its year range are skipped by their statistics."""
+    settings = DATASET_VIEWS[view]
+    return pq.read_table(
+        parquet_path,
+        columns=settings['columns'],
+        filters=year_filter(settings['year_range'])
+    ).to_pandas()
+
+
+def categorical_from_dictionary(array):
+    """Wrap the dictionary array in a categorical whose codes are the indices in the memory map.
+
+    convert_to_arrow writes the codes of pandas as indices, so that missing values keep the code -1 under their null
+    bit and the indices can be used as codes without copying them.
+    """
+    indices = array.indices
+    codes = np.frombuffer(
+        indices.buffers()[1],
+        dtype=indices.type.to_pandas_dtype(),
+        count=len(indices),
+        offset=indices.offset * indices.type.bit_width // 8
+    )
+    return pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(array.dictionary.to_pandas()))
+
+
+def read_memory_mapped(view, arrow_path=ARROW_DATASET_PATH):
+    """Memory-map the Arrow file read-only and wrap the columns of the view in a data frame without copying them.
+
+    All processes mapping the same file share the same physical pages, so the memory of the dataset does not grow
+    with the number of workers. Pages of columns which the view does not use are never read. The columns are
+    read-only and in the compact layout, the research categories of the view are read as their bit column.
+    Only a year range of the view copies the selected rows.
+    """
+    settings = DATASET_VIEWS[view]
+    stored_columns = [column for column in settings['columns'] if column not in CATEGORY_BITS]
+    if len(stored_columns) < len(settings['columns']):
+        stored_columns.append('Categories')
+    # The memory map stays open as long as the columns reference its buffers
+    table = pa.ipc.open_file(pa.memory_map(arrow_path, 'r')).read_all().select(stored_columns)
+    if settings['year_range'] is not None:
+        table = table.filter(year_filter(settings['year_range']))
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        if pa.types.is_dictionary(array.type) and settings['year_range'] is None:
+            columns[name] = categorical_from_dictionary(array)
+        elif pa.types.is_dictionary(array.type):
+            # The filtered rows are a copy whose indices of missing values are not the codes of pandas, the countries
+            # outside of the year range are dropped like compact_dataset does
+            columns[name] = array.to_pandas().cat.remove_unused_categories().array
+        else:
+            columns[name] = array.to_numpy(zero_copy_only=array.null_count == 0)
+    return pd.DataFrame(columns, copy=False)
+
+
+def category_mask(data, category):
+    """Return a boolean mask of the papers which belong (partly) to the research category."""
+    if 'Categories' in data:
+        return (data['Categories'].to_numpy() >> CATEGORY_BITS[category] & 1).astype(bool)
+    return data[category].to_numpy(dtype=bool)
+
+
+def compact_dataset(data):
+    """Pack the research categories into the bits of one column and let the country names share the country codes.
+
+    Country names are only shared if they are unique per country code, otherwise the column is kept as it is.
+    """
+    categories = np.zeros(len(data), dtype=np.uint8)
+    for category, bit in CATEGORY_BITS.items():
+        categories |= data[category].to_numpy(dtype=bool).astype(np.uint8) << bit
+    columns = {
+        'PY': data['PY'].to_numpy().astype(np.uint16, copy=False),
+        'Organisation': data['Organisation'].astype('category').array,
+        'CountryCode': data['CountryCode'].astype('category').cat.remove_unused_categories().array,
+        'Country': data['Country'].array,
+        'Categories': categories
+    }
+    country_codes = columns['CountryCode']
+    pairs = pd.DataFrame({'CountryCode': country_codes, 'Country': columns['Country']}).drop_duplicates()
+    # Only share the codes if country code and name always come in pairs (or are both missing)
+    if pairs['CountryCode'].is_unique and pairs['Country'].is_unique and (
+            pairs['CountryCode'].isna() == pairs['Country'].isna()).all():
+        names = pairs.dropna().set_index('CountryCode')['Country'].reindex(country_codes.categories)
+        columns['Country'] = pd.Categorical.from_codes(country_codes.codes, categories=names.astype(str).values)
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_dataset(view):
+    """Load the dataset of the view in the configured mode."""
+    if DATASET_LOAD_MODE == 'mmap':
+        convert_to_arrow()
+        # The Arrow file is already in the compact layout
+        return read_memory_mapped(view)
+    data = read_parquet(view)
+    if DATASET_VIEWS[view].get('compact'):
+        data = compact_dataset(data)
+    return data
+
+
+def get_dataset(view='analyses'):
+    """Return the dataset of the view, it is loaded on the first call."""
+    with _dataset_lock:
+        if view not in _datasets:
+            _datasets[view] = load_dataset(view)
+    return _datasets[view]
+
+
+def replace_dataset(data, view='analyses'):
+    """Use the data instead of the dataset file for the view, e.g. a synthetic copy in benchmarks."""
+    with _dataset_lock:
+        _datasets[view] = data
+        _replaced_views.add(view)
+
+
+def is_replaced(view='analyses'):
+    """Return whether the dataset of the view was replaced, aggregates of the dataset file do not belong to it then."""
+    return view in _replaced_views
+
+
+def dataset_year_range(parquet_path=DATASET_PATH):
+    """Return the first and last publication year without loading the dataset."""
+    metadata = pq.ParquetFile(parquet_path).metadata
+    column = metadata.schema.names.index('PY')
+    statistics = [metadata.row_group(index).column(column).statistics for index in range(metadata.num_row_groups)]
+    # Use the statistics of the row groups if the file has them, otherwise only read the year column
+    if statistics and all(stats is not None and stats.has_min_max for stats in statistics):
+        return min(stats.min for stats in statistics), max(stats.max for stats in statistics)
+    min_max = pc.min_max(pq.read_table(parquet_path, columns=['PY'])['PY'])
+    return min_max['min'].as_py(), min_max['max'].as_py()
+
+
+if __name__ == '__main__':
+    convert_to_arrow()
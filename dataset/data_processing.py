@@ -1,235 +1,754 @@
-"""
-Data processing
-"""
-# %% -- Load needed libraries
-print("In order to run this script you need pandas, numpy, re, tqdm, pycountry and pyarrow installed")
-import pandas as pd
-import numpy as np
+# -*- coding: utf-8 -*-
+"""Turn the Web of Science exports into the dataset of the dashboard, papers.parquet."""
+
+# Run `python data_processing.py build` in this directory to process DL_PAPER_1990_2018.tsv and DL_COUNTRY_REGION.tsv.
+# The pipeline runs in stages and every stage writes its output to the cache directory, named by the hash of its
+# inputs, so a re-run only repeats the stages whose inputs changed. Bump the version of a stage in STAGE_VERSIONS when
+# its code changes.
+# The exports are streamed in chunks, which a pool of processes (--workers) normalises and classifies into parquet
+# parts, so the memory is bounded by the chunks and by the largest year instead of the exports. papers.parquet has one
+# row group per year, ordered by year.
+# The exports are processed in batches. When a new year arrives, run
+# `python data_processing.py append DL_PAPER_2019.tsv DL_COUNTRY_REGION_2019.tsv`: only its papers are processed,
+# the earlier batches come from the cache. Papers of a batch are classified with the organisations of all batches up to
+# it, so the earlier papers keep their organisations.
+# Run `python data_processing.py check-labels` to compare the organisations of a sample of papers to the original,
+# quadratic classification.
+# Run `python data_processing.py reports` to create the profiling reports of papers.parquet.
+# It needs pandas, numpy, pycountry and pyarrow, the reports need pandas-profiling and sweetviz.
+
+import argparse
+import collections
+import glob
+import hashlib
+import json
+import os
 import re
-from tqdm import tqdm_notebook
-import pycountry
-
-# %% -- Load dataset
-papers = pd.read_csv("DL_PAPER_1990_2018.tsv", sep='\t')
-"In case of an issue, try to install the 'xlrd' dependency : pip install xlrd"
-
-# %% -- Filter
-"First, we remove all the observations where we don't have any information on who published this paper"
-papers.dropna(subset=["C1"], inplace=True, axis=0)
-# Drop duplicates, if they exist
-papers.drop_duplicates(subset=["AB"], inplace=True)
-papers = papers.reset_index()
-
-# %% -- Clean fields
-"A lot of issues with observations where we have a pattern like this: [name"
-papers.C1 = [re.sub("[\(\[].*?[\)\]]", "", sentence).lstrip() for sentence in tqdm_notebook(papers.C1)]
-
-# %% -- Extract C1 information
-"""
-Pattern: name always before the first comma
-We can extract this information with a more efficient way than regex
-"""
-names_1 = []
-names_2 = []
-for obs in papers.C1:
-    sentence = obs.split(';', 1)[0]
-    names_1.append(sentence.split(',', 1)[0])
-    try:
-        sentence = obs.split(';', 1)[1]
-        names_2.append(sentence.split(',', 1)[0])
-    except IndexError:
-        names_2.append(np.nan)
-papers.C1 = names_1
-papers["C2"] = names_2
-del names_1, names_2, obs, sentence
-
-# %% -- Show results
-print(papers.C1.head(20), papers.C2.head(20))  # Good!
-
-# %% -- Replace "Univ" by "University" ; "Inst" by "Institute" ; "Acad" by "Academy"
-papers.C1 = papers.C1.str.replace("Univ", "University")
-papers.C1 = papers.C1.str.replace("UNIV", "University")  # In case we have an issue with the first one
-papers.C1 = papers.C1.str.replace("Inst", "Institute")
-papers.C1 = papers.C1.str.replace("Acad", "Academy")
-papers.C1 = papers.C1.str.replace("Coll", "College")
-
-papers.C2 = papers.C2.str.replace("Univ", "University")
-papers.C2 = papers.C2.str.replace("UNIV", "University") 
-papers.C2 = papers.C2.str.replace("Inst", "Institute")
-papers.C2 = papers.C2.str.replace("Acad", "Academy")
-papers.C2 = papers.C2.str.replace("Coll", "College")
-
-# %% -- More information about firms
-# First, isolate which not contains "University"
-stopwords = ["Ecole", "University", "MIT", "CNR", "CNRS", "UMIST", "Institute", "ESCPI", "ENSCP",
-             "Academy", "UNR", "USA", "ESCPI", "INSA", "NASA", "UCL", "RIKEN", "LORIA", "IPN", "CSIC", "CHU"
-             "ETIS", "USAF", "Politecn", "Kings Coll London", "London Coll", "NYU", "IDSIA", "Coll Canada",
-             "UNICAMP", "UTBM", "CSIRO", "Commiss European", "OECD", "USTHB", "UFRJ", "CEA", "UPC", "INRA",
-             "US FDA", "NOAA", "UNESP", "ENEA", "IIT", "SISSA", "IDIAP", "CUNY", "INSERM", "INRIA", "College",
-             "UNESCO", "INOAE", "NIST", "CERN", "CSIR", "Polytech", "EPFL", "MITS", "NIMH", "IFREMER"]
-pat = r"({})".format('|'.join(stopwords))
-filtered_pap = papers[~papers.C1.str.contains(pat, case=False, na=False)]
-
-# %% -- Create separation between company only and collaborations
-firms_stopwords = pd.unique(filtered_pap.C1.values)
-joined = filtered_pap[["C1", "C2"]].values.tolist()
-types = []
-for obs in tqdm_notebook(joined):
-    if obs[1] is np.nan:
-        types.append("Company")
-    else:
-        if all(words in " ".join(firms_stopwords) for words in obs):
-            types.append("Company")
-        else:
-            types.append("Collaboration")
-
-filtered_pap["Organisation"] = types
-papers = papers.merge(filtered_pap, how="left")
-
-# %% -- Redo the manipulation for other papers (i.e., academia)
-filtered_pap = papers[papers.Organisation.isna()]
-academic_stopwords = pd.unique(filtered_pap.C1.values)
-joined = filtered_pap[["C1","C2"]].values.tolist()
-types = []
-for obs in tqdm_notebook(joined):
-    if obs[1] is np.nan:
-        types.append("Academia")
-    else:
-        if all(word in " ".join(academic_stopwords) for word in obs):
-            types.append("Academia")
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# --- FILES ---
+PAPERS_PATH = 'DL_PAPER_1990_2018.tsv'
+COUNTRIES_PATH = 'DL_COUNTRY_REGION.tsv'
+OUTPUT_PATH = 'papers.parquet'
+CACHE_DIR = '.etl_cache'
+# Lists the batches of exports of papers.parquet
+MANIFEST_NAME = 'manifest.json'
+
+# Version of the code of each stage, it is part of the key of the cached outputs
+STAGE_VERSIONS = {'affiliations': 3, 'organisations': 5, 'countries': 2, 'dataset': 2}
+
+# Rows of an export which are read and processed at once, with the number of workers they bound the memory
+CHUNK_ROWS = 50000
+
+# --- PAPERS ---
+PAPER_COLUMNS = ['UT', 'PY', 'SC', 'ArtsHumanities', 'LifeSciencesBiomedicine', 'PhysicalSciences', 'SocialSciences',
+                 'Technology', 'ComputerScience', 'Health', 'NR', 'TCperYear', 'nb_aut']
+
+# Patterns like [name or (name) in the affiliations
+BRACKETS = re.compile(r'[\(\[].*?[\)\]]')
+
+# Abbreviations in the names of the organisations and their expansions.
+# They do not overlap and no expansion contains an abbreviation, so replacing them in one pass equals replacing one
+# after the other.
+ABBREVIATIONS = {'Univ': 'University', 'UNIV': 'University', 'Inst': 'Institute', 'Acad': 'Academy', 'Coll': 'College'}
+ABBREVIATION_PATTERN = re.compile('|'.join(ABBREVIATIONS))
+
+# Organisations whose name contains one of these words (in any case) are academic.
+# 'CHUETIS' lacks a comma between 'CHU' and 'ETIS', the organisations of the dataset were classified like this.
+ACADEMIC_WORDS = ['Ecole', 'University', 'MIT', 'CNR', 'CNRS', 'UMIST', 'Institute', 'ESCPI', 'ENSCP', 'Academy', 'UNR',
+                  'USA', 'ESCPI', 'INSA', 'NASA', 'UCL', 'RIKEN', 'LORIA', 'IPN', 'CSIC', 'CHUETIS', 'USAF',
+                  'Politecn', 'Kings Coll London', 'London Coll', 'NYU', 'IDSIA', 'Coll Canada', 'UNICAMP', 'UTBM',
+                  'CSIRO', 'Commiss European', 'OECD', 'USTHB', 'UFRJ', 'CEA', 'UPC', 'INRA', 'US FDA', 'NOAA',
+                  'UNESP', 'ENEA', 'IIT', 'SISSA', 'IDIAP', 'CUNY', 'INSERM', 'INRIA', 'College', 'UNESCO', 'INOAE',
+                  'NIST', 'CERN', 'CSIR', 'Polytech', 'EPFL', 'MITS', 'NIMH', 'IFREMER']
+ACADEMIC_PATTERN = re.compile('|'.join(ACADEMIC_WORDS), re.IGNORECASE)
+
+# --- COUNTRIES ---
+REGION_NAMES = {
+    'WesternEurope': 'Western Europe',
+    'Eastern Europe Central Asia': 'Eastern Europe to Central Asia',
+    'MiddleEast North Africa': 'MiddleEast and North Africa',
+    'SouthEast Asia Pacific': 'SouthEast Asia and Pacific',
+    'Latin America Caribbean': 'Latin America and Caribbean'
+}
+# Country names which pycountry does not find
+COUNTRY_NAMES = {
+    'Iran (Islamic Republic of)': 'Iran, Islamic Republic of',
+    'The former Yugoslav Republic of Macedonia': 'North Macedonia',
+    'Libyan Arab Jamahiriya': 'Libya',
+    'Trinid & Tobago': 'Trinidad and Tobago',
+    'Fr Polynesia': 'French Polynesia',
+    'Laos': "Lao People's Democratic Republic",
+    'Swaziland': 'Eswatini',
+    'Western Samoa': 'Samoa',
+    'W Ind Assoc St': 'United Kingdom',
+    'Ankara': 'Turkey',
+    'Arizona': 'USA',
+    'Democratic Republic of the Congo': 'Congo, The Democratic Republic of the',
+    'Miaoli': 'Taiwan',
+    'St Vincent': 'Saint Vincent and the Grenadines',
+    'Uae': 'United Arab Emirates',
+    'Serbia Monteneg': 'Serbia and Montenegro',
+    '*': np.nan
+}
+# Country codes which the fuzzy search gets wrong, and the codes of historic countries
+COUNTRY_CODES = {
+    'Guadeloupe': 'GLP',
+    'Niger': 'NER',
+    'Kosovo': 'UNK',
+    'Yugoslavia': 'YUG',
+    'Serbia and Montenegro': 'SCG',
+    'Ussr': 'SUN',
+    'Czechoslovakia': 'CSK'
+}
+
+# --- DATASET ---
+CATEGORY_COLUMNS = ['SC', 'Organisation', 'Region', 'Country', 'CountryCode']
+UNSIGNED_COLUMNS = ['PY', 'NR', 'NumAuthors', 'ComputerScience', 'Health']
+
+
+# --- STAGES ---
+def abstract_digests(abstracts):
+    """Identify the abstracts by hashes of 16 bytes, missing abstracts by None."""
+    return [
+        None if pd.isna(abstract) else hashlib.blake2b(abstract.encode(), digest_size=16).digest()
+        for abstract in abstracts
+    ]
+
+
+def read_papers(pipeline, path, earlier_digests, directory):
+    """Stream the new papers which have affiliations through the normalisation of their affiliations into parts.
+
+    Papers are new if their abstract is not in the earlier batches or earlier in the export.
+    """
+    seen = set(earlier_digests)
+
+    def new_papers():
+        """Yield the arguments of the normalisation of each chunk of new papers."""
+        chunks = pd.read_csv(path, sep='\t', dtype={'UT': str, 'AB': str, 'C1': str}, chunksize=pipeline.chunk_rows)
+        for index, chunk in enumerate(chunks):
+            # Without affiliations we don't know who published the paper
+            chunk = chunk.dropna(subset=['C1'])
+            digests = abstract_digests(chunk['AB'])
+            new = np.empty(len(digests), dtype=bool)
+            for row, digest in enumerate(digests):
+                new[row] = digest not in seen
+                seen.add(digest)
+            papers = chunk.loc[new, [*PAPER_COLUMNS, 'C1']].assign(ABDigest=np.array(digests, dtype=object)[new])
+            yield papers, part_path(directory, index)
+
+    return sum(pipeline.map(normalise_chunk, new_papers()))
+
+
+class AffiliationNormaliser:
+    """Extract the first two organisations of affiliations, expand their abbreviations and find the academic ones.
+
+    Each affiliation is processed in one pass by the compiled patterns and each distinct name of an organisation is
+    normalised once. The results are written to buffers which the next call reuses.
+    """
+
+    def __init__(self):
+        """Create empty buffers, they grow with the affiliations."""
+        self.first = np.empty(0, dtype=object)
+        self.second = np.empty(0, dtype=object)
+        self.academic = np.empty(0, dtype=bool)
+        # Normalised names and whether they are academic by the names in the affiliations
+        self.names = {}
+
+    def normalise_name(self, name):
+        """Return the name with expanded abbreviations and whether it is academic."""
+        if name not in self.names:
+            expanded = ABBREVIATION_PATTERN.sub(lambda match: ABBREVIATIONS[match.group()], name)
+            self.names[name] = expanded, ACADEMIC_PATTERN.search(expanded) is not None
+        return self.names[name]
+
+    def normalise(self, addresses):
+        """Return the first organisations, the second organisations (or NaN) and whether the first ones are academic.
+
+        The addresses are strings, e.g. a column or an Arrow string array. The results are views of the buffers, they
+        are overwritten by the next call.
+        """
+        if isinstance(addresses, (pa.Array, pa.ChunkedArray)):
+            addresses = addresses.to_numpy(zero_copy_only=False)
+        size = len(addresses)
+        if size > len(self.first):
+            self.first = np.empty(size, dtype=object)
+            self.second = np.empty(size, dtype=object)
+            self.academic = np.empty(size, dtype=bool)
+        for index, address in enumerate(addresses):
+            if '(' in address or '[' in address:
+                address = BRACKETS.sub('', address)
+            # The name of the organisation is always before the first comma of the affiliation
+            first, separator, rest = address.lstrip().partition(';')
+            self.first[index], self.academic[index] = self.normalise_name(first.partition(',')[0])
+            self.second[index] = self.normalise_name(rest.partition(',')[0])[0] if separator else np.nan
+        return self.first[:size], self.second[:size], self.academic[:size]
+
+
+# Normaliser of the worker process, it reuses its buffers and names for all chunks
+_normaliser = None
+
+
+def normalise_chunk(papers, path):
+    """Replace the affiliations of the papers by their first two organisations, C1 and C2 (or NaN), in the part.
+
+    Academic tells whether the first organisation is academic.
+    """
+    global _normaliser
+    if _normaliser is None:
+        _normaliser = AffiliationNormaliser()
+    first, second, academic = _normaliser.normalise(papers['C1'].to_numpy())
+    papers.assign(C1=first, C2=second, Academic=academic).to_parquet(path)
+    return len(papers)
+
+
+def occurring_names(names, text):
+    """Return the names which occur in the text, found in one scan of it by an Aho-Corasick automaton of the names."""
+    # The empty name occurs in every text
+    found = {name for name in names if not name}
+    # Trie of the names, node 0 is the root. The name which ends at each node, if any
+    transitions = [{}]
+    ends = [None]
+    for name in names:
+        node = 0
+        for character in name:
+            if character not in transitions[node]:
+                transitions[node][character] = len(transitions)
+                transitions.append({})
+                ends.append(None)
+            node = transitions[node][character]
+        if name:
+            ends[node] = name
+    # The failure of a node is the node of its longest proper suffix in the trie, its output the node of its longest
+    # suffix which is a name (or -1)
+    failures = [0] * len(transitions)
+    outputs = [-1] * len(transitions)
+    queue = collections.deque()
+    for child in transitions[0].values():
+        outputs[child] = child if ends[child] is not None else -1
+        queue.append(child)
+    while queue:
+        node = queue.popleft()
+        for character, child in transitions[node].items():
+            failure = failures[node]
+            while failure and character not in transitions[failure]:
+                failure = failures[failure]
+            failures[child] = transitions[failure].get(character, 0)
+            outputs[child] = child if ends[child] is not None else outputs[failures[child]]
+            queue.append(child)
+    # Every name is reported once, so the scan stays linear in the text and the names
+    reported = [False] * len(transitions)
+    node = 0
+    for character in text:
+        while node and character not in transitions[node]:
+            node = failures[node]
+        node = transitions[node].get(character, 0)
+        output = outputs[node]
+        while output >= 0 and not reported[output]:
+            reported[output] = True
+            found.add(ends[output])
+            output = outputs[failures[output]]
+    return found
+
+
+class Vocabulary:
+    """Organisations of the papers, answering whether a name occurs in their names joined by spaces.
+
+    Joining and searching the names for every paper took quadratic time. The names of the vocabulary occur anyway, all
+    other names, e.g. parts of names, are searched at once: an Aho-Corasick automaton of them scans the joined names
+    once. Search the names of all papers before classifying them, so that the joined names are only scanned once.
+    """
+
+    def __init__(self, names):
+        """Index the names."""
+        self.names = list(names)
+        self.joined = ' '.join(self.names)
+        # Whether each name searched so far occurs in the joined names
+        self.occurs = dict.fromkeys(self.names, True)
+
+    def search(self, names):
+        """Find out which of the names occur in the joined names, the new ones are searched in one scan."""
+        new = {name for name in names if name not in self.occurs}
+        if new:
+            found = occurring_names(new, self.joined)
+            self.occurs.update((name, name in found) for name in new)
+
+    def __contains__(self, name):
+        """Return whether the name occurs in the joined names, it is searched if it was not yet."""
+        if name not in self.occurs:
+            self.search([name])
+        return self.occurs[name]
+
+
+def read_vocabularies(pipeline, affiliations_keys):
+    """Return the vocabularies of companies and academia, the first organisations of the papers of the batches."""
+    # Dictionaries keep the order of the names, the joined names depend on it
+    companies = {}
+    academia = {}
+    for key in affiliations_keys:
+        for part in pipeline.parts('affiliations', key):
+            affiliations = pd.read_parquet(part, columns=['C1', 'Academic'])
+            names = affiliations['C1'].to_numpy()
+            academic = affiliations['Academic'].to_numpy()
+            companies.update(dict.fromkeys(pd.unique(names[~academic])))
+            academia.update(dict.fromkeys(pd.unique(names[academic])))
+    return {'Company': Vocabulary(companies), 'Academia': Vocabulary(academia)}
+
+
+def searched_names(affiliations):
+    """Return the organisations of the papers which label_organisations looks up, those of papers with two of them."""
+    with_second = affiliations[affiliations['C2'].notna()]
+    return [*with_second['C1'], *with_second['C2']]
+
+
+def label_organisations(affiliations, vocabulary, label):
+    """Label papers whose organisations both occur in the vocabulary, or which only have one, the others collaborate."""
+    vocabulary.search(searched_names(affiliations))
+    return [
+        label if pd.isna(second) or (first in vocabulary and second in vocabulary) else 'Collaboration'
+        for first, second in zip(affiliations['C1'], affiliations['C2'])
+    ]
+
+
+def label_organisations_quadratic(affiliations, vocabulary, label):
+    """Label the papers like label_organisations, by joining and searching the vocabulary for every paper."""
+    # The original classification, the reference of check_labels
+    labels = []
+    for names in affiliations[['C1', 'C2']].values.tolist():
+        if pd.isna(names[1]) or all(name in ' '.join(vocabulary.names) for name in names):
+            labels.append(label)
         else:
-            types.append("Collaboration")
-
-filtered_pap["Organisation_bis"] = types
-papers = papers.merge(filtered_pap, how="left")
-papers.Organisation.fillna(papers.Organisation_bis, inplace=True)
-
-# %% -- Keep Only interesting variables
-papers = papers[["UT", "PY", "SC", "ArtsHumanities", "LifeSciencesBiomedicine", "PhysicalSciences", "SocialSciences",
-                 "Technology", "ComputerScience", "Health", "NR", "TCperYear", "nb_aut", "Organisation"]]
-
-# %% -- Aggregate country and regions
-# - Load 2nd dataset
-dl_country = pd.read_csv("DL_COUNTRY_REGION.tsv", sep='\t')
-# - Drop unneeded variables
-dl_country.drop(["aff", "PY"], axis=1, inplace=True)
-# - Rename some regions
-dl_country["Region"].replace({
-        "WesternEurope": "Western Europe",
-        "Eastern Europe Central Asia": "Eastern Europe to Central Asia",
-        "MiddleEast North Africa": "MiddleEast and North Africa",
-        "SouthEast Asia Pacific": "SouthEast Asia and Pacific",
-        "Latin America Caribbean": "Latin America and Caribbean"
-    },
-    inplace=True
-)
-dl_country["Region"].value_counts(normalize=True)
-
-# %% -- Improve country names
-# - Rename US states: Country values with only two letters are US states
-dl_country["C1"] = dl_country["C1"].apply(lambda country: "USA" if len(country) == 2 else country)
-# - Improve some country names
-dl_country["C1"].replace({
-        "Iran (Islamic Republic of)": "Iran, Islamic Republic of",
-        "The former Yugoslav Republic of Macedonia": "North Macedonia",
-        "Libyan Arab Jamahiriya": "Libya",
-        "Trinid & Tobago": "Trinidad and Tobago",
-        "Fr Polynesia": "French Polynesia",
-        "Laos": "Lao People's Democratic Republic",
-        "Swaziland": "Eswatini",
-        "Western Samoa": "Samoa",
-        "W Ind Assoc St": "United Kingdom",
-        "Ankara": "Turkey",
-        "Arizona": "USA",
-        "Democratic Republic of the Congo": "Congo, The Democratic Republic of the",
-        "Miaoli": "Taiwan",
-        "St Vincent": "Saint Vincent and the Grenadines",
-        "Uae": "United Arab Emirates",
-        "Serbia Monteneg": "Serbia and Montenegro",
-        "*": np.nan
-    },
-    inplace=True
-)
-# - Create a list of used countries
-ct = dl_country["C1"].value_counts().to_frame().reset_index()
-ct.rename({"index": "Country"}, axis='columns', inplace=True)
-ct.drop(["C1"], axis="columns", inplace=True)
-
-# %% -- Identify countries
-def getCountryCode(country):
+            labels.append('Collaboration')
+    return labels
+
+
+def classify_organisations(affiliations, vocabularies, label_function=label_organisations):
+    """Classify the papers as published by a Company, by Academia or in Collaboration.
+
+    Papers whose first organisation is not academic are published by a company if both organisations occur in the
+    vocabulary of the companies. Likewise for academia.
+    """
+    academic = affiliations['Academic'].to_numpy()
+    organisations = np.empty(len(affiliations), dtype=object)
+    organisations[~academic] = label_function(affiliations[~academic], vocabularies['Company'], 'Company')
+    organisations[academic] = label_function(affiliations[academic], vocabularies['Academia'], 'Academia')
+    return affiliations[PAPER_COLUMNS].assign(Organisation=organisations)
+
+
+# Vocabularies of the worker process
+_vocabularies = None
+
+
+def set_vocabularies(vocabularies):
+    """Keep the searched vocabularies once per worker process."""
+    global _vocabularies
+    _vocabularies = vocabularies
+
+
+def classify_part(source, path):
+    """Classify the papers of a part of the affiliations into a part of the organisations."""
+    affiliations = pd.read_parquet(source)
+    classify_organisations(affiliations, _vocabularies).to_parquet(path)
+    return len(affiliations)
+
+
+def country_code(country):
+    """Return the ISO 3166-1 alpha-3 code of the country, or NaN if pycountry does not find it."""
+    # Only the countries need pycountry, so the classification can be imported without it
+    import pycountry
     try:
         return pycountry.countries.search_fuzzy(country)[0].alpha_3
-    except:
+    except LookupError:
         return np.nan
 
-ct["CountryCode"] = ct["Country"].apply(getCountryCode)
-# - Correct some country codes manually
-ct["CountryCode"].mask(ct["Country"] == "Guadeloupe", "GLP", inplace=True)
-ct["CountryCode"].mask(ct["Country"] == "Niger", "NER", inplace=True)
-ct["CountryCode"].mask(ct["Country"] == "Kosovo", "UNK", inplace=True)
-# - Add historic country codes
-ct["CountryCode"].mask(ct["Country"] == "Yugoslavia", "YUG", inplace=True)
-ct["CountryCode"].mask(ct["Country"] == "Serbia and Montenegro", "SCG", inplace=True)
-ct["CountryCode"].mask(ct["Country"] == "Ussr", "SUN", inplace=True)
-ct["CountryCode"].mask(ct["Country"] == "Czechoslovakia", "CSK", inplace=True)
-print("Finished identifying countries")
-# - Add country code column using the new table
-dl_country = dl_country.merge(ct, how="left", left_on="C1", right_on="Country")
-
-# %% -- Add Country and Regions
-final_df = papers.merge(dl_country, how="inner")
-# - Drop "UT" features and "Nb_aut_aff"
-final_df.drop(["UT", "nb_aut_aff", "C1"], axis="columns", inplace=True)
-# - Rename features
-final_df.rename({"nb_aut": "NumAuthors"}, axis="columns", inplace=True)
-# - Drop duplicates
-final_df.drop_duplicates(inplace=True)
-# - Re-index
-final_df.reset_index(drop=True, inplace=True)
-
-# %% -- Save final dataset to CSV
-final_df.to_csv("papers.csv", index=False)
-
-# %% -- Show column and memory info
-final_df.info(memory_usage="deep")
-final_df.memory_usage(deep=True)
-final_df.agg(["size", "count", "nunique", "std", "min",  "median", "max"])
-
-# %% -- Optimize data types
-opt_df = final_df.copy()
-# - Convert to categories
-opt_df["SC"] = final_df["SC"].astype("category")
-opt_df["Organisation"] = final_df["Organisation"].astype("category")
-opt_df["Region"] = final_df["Region"].astype("category")
-opt_df["Country"] = final_df["Country"].astype("category")
-opt_df["CountryCode"] = final_df["CountryCode"].astype("category")
-# - Downcast integers
-opt_df[
-    ["PY", "NR", "NumAuthors", "ComputerScience", "Health"]
-    ] = final_df[
-    ["PY", "NR", "NumAuthors", "ComputerScience", "Health"]
-    ].apply(pd.to_numeric, downcast="unsigned")
-
-# %% -- Check optimized dataframe
-opt_df.info(memory_usage="deep")
-print("Memory reduction: ", round(100 - 100
-                                  * opt_df.memory_usage(deep=True).sum()
-                                  / final_df.memory_usage(deep=True).sum()
-                                  ), '%')
-
-# %% -- Save as a Parquet file
-# - Parquet: a compressed file that memorizes dtypes
-# - Requires pyarrow: 'conda install -c conda-forge pyarrow' or 'pip install pyarrow'
-opt_df.to_parquet("papers.parquet", compression="gzip")
-
-# %% -- Create pandas profiling report
-# - https://github.com/pandas-profiling/pandas-profiling
-from pandas_profiling import ProfileReport
-pp_report = ProfileReport(opt_df, title="Papers - Pandas Profiling Report")
-pp_report.to_file("papers_pandas-profiling-report.html")
-
-# %% -- Create Sweetviz profiling report
-# - https://github.com/fbdesignpro/sweetviz
-import sweetviz
-sv_report = sweetviz.analyze(opt_df)
-sv_report.show_html(filepath="papers_sweetviz-report.html", open_browser=False)
+
+def read_countries(pipeline, path, directory):
+    """Stream the countries and regions of the papers into parts and identify the countries by their codes."""
+    codes = {}
+    num_rows = 0
+    chunks = pd.read_csv(path, sep='\t', dtype={'UT': str, 'C1': str}, chunksize=pipeline.chunk_rows)
+    for index, countries in enumerate(chunks):
+        countries = countries.drop(columns=['aff', 'PY'])
+        countries['Region'] = countries['Region'].replace(REGION_NAMES)
+        # Country values with only two letters are US states
+        countries['C1'] = countries['C1'].apply(lambda country: 'USA' if len(country) == 2 else country)
+        countries['C1'] = countries['C1'].replace(COUNTRY_NAMES)
+        for country in countries['C1'].dropna().unique():
+            if country not in codes:
+                codes[country] = COUNTRY_CODES[country] if country in COUNTRY_CODES else country_code(country)
+        countries = countries.assign(Country=countries['C1'], CountryCode=countries['C1'].map(codes))
+        countries.to_parquet(part_path(directory, index))
+        num_rows += len(countries)
+    return num_rows
+
+
+def split_buckets(source, path, name, first_position, num_buckets):
+    """Sort a part into the buckets of the join by the hash of UT, one row group per bucket.
+
+    The rows keep their positions in the batch. Return the row group of each bucket which has rows.
+    """
+    table = pq.read_table(source)
+    positions = np.arange(first_position, first_position + table.num_rows)
+    table = table.append_column(f'{name}Position', pa.array(positions))
+    buckets = pd.util.hash_pandas_object(table.column('UT').to_pandas(), index=False).to_numpy() % num_buckets
+    table = table.take(np.argsort(buckets, kind='stable'))
+    counts = np.bincount(buckets, minlength=num_buckets)
+    row_groups = {}
+    start = 0
+    with pq.ParquetWriter(path, table.schema) as writer:
+        for bucket in np.flatnonzero(counts):
+            writer.write_table(table.slice(start, counts[bucket]))
+            row_groups[int(bucket)] = len(row_groups)
+            start += counts[bucket]
+    return row_groups
+
+
+def read_row_groups(row_groups):
+    """Read the row groups, given by their files, into one data frame."""
+    return pd.concat([pq.ParquetFile(path).read_row_group(row_group).to_pandas() for path, row_group in row_groups],
+                     ignore_index=True)
+
+
+def join_bucket(papers, countries, path):
+    """Join the row groups of the papers of a bucket with those of their countries, one row group per year."""
+    if not papers or not countries:
+        return 0
+    dataset = read_row_groups(papers).merge(read_row_groups(countries), how='inner')
+    dataset = dataset.drop(columns=['UT', 'nb_aut_aff', 'C1']).rename(columns={'nb_aut': 'NumAuthors'})
+    dataset = dataset.sort_values('PY', kind='stable')
+    table = pa.Table.from_pandas(dataset, preserve_index=False)
+    years = pd.factorize(dataset['PY'])[0]
+    bounds = [0, *np.flatnonzero(years[1:] != years[:-1]) + 1, len(years)]
+    with pq.ParquetWriter(path, table.schema) as writer:
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            writer.write_table(table.slice(start, stop - start))
+    return len(dataset)
+
+
+def combine(pipeline, organisations_parts, countries_parts, directory):
+    """Join the papers with their countries, the dataset has one row per paper and country.
+
+    Both are split into buckets by UT, which are joined in parallel. A bucket holds about a chunk of rows, so the
+    memory of a join is bounded. The rows keep the positions of the paper and of the country in the batch, the order
+    of the original join.
+    """
+    buckets_dir = os.path.join(directory, 'buckets')
+    os.makedirs(buckets_dir)
+    num_rows = [list(map(num_parquet_rows, parts)) for parts in (organisations_parts, countries_parts)]
+    num_buckets = max(pipeline.workers, -(-max(map(sum, num_rows)) // pipeline.chunk_rows))
+    splits = [
+        (part, os.path.join(buckets_dir, f'{name}-{index:05d}.parquet'), name, first_position, num_buckets)
+        for name, parts, rows in zip(('Paper', 'Country'), (organisations_parts, countries_parts), num_rows)
+        for index, (part, first_position) in enumerate(zip(parts, np.cumsum([0, *rows[:-1]])))
+    ]
+    buckets = [{'Paper': [], 'Country': []} for _ in range(num_buckets)]
+    for (_, path, name, _, _), row_groups in zip(splits, pipeline.map(split_buckets, splits)):
+        for bucket, row_group in row_groups.items():
+            buckets[bucket][name].append((path, row_group))
+    joined = sum(pipeline.map(join_bucket, [
+        (bucket['Paper'], bucket['Country'], part_path(directory, index)) for index, bucket in enumerate(buckets)
+    ]))
+    shutil.rmtree(buckets_dir)
+    return joined
+
+
+def deduplicate_year(row_groups, path):
+    """Write the distinct rows of a year in the order of the batches and return their number, categories and types.
+
+    Duplicate rows have the same year, so dropping them by year drops all of them.
+    """
+    dataset = pd.concat([
+        pq.ParquetFile(part).read_row_group(row_group).to_pandas().assign(Batch=batch)
+        for batch, part, row_group in row_groups
+    ], ignore_index=True)
+    dataset = dataset.sort_values(['Batch', 'PaperPosition', 'CountryPosition'], kind='stable')
+    dataset = dataset.drop(columns=['Batch', 'PaperPosition', 'CountryPosition']).drop_duplicates()
+    dataset.to_parquet(path, index=False)
+    categories = {column: set(dataset[column].dropna()) for column in CATEGORY_COLUMNS}
+    dtypes = {
+        column: pd.to_numeric(dataset[column], downcast='unsigned').dtype if column in UNSIGNED_COLUMNS else dtype
+        for column, dtype in dataset.dtypes.items() if column not in CATEGORY_COLUMNS
+    }
+    return len(dataset), categories, dtypes
+
+
+def write_dataset(pipeline, dataset_keys, output_path, csv_path=None):
+    """Write the distinct rows of the datasets of the batches with one row group per year and return their number.
+
+    Text columns are stored as categories and integer columns in the smallest unsigned types which fit all years.
+    """
+    # Find the row groups of each year by their statistics, rows without a year have none
+    years = {}
+    for batch, key in enumerate(dataset_keys):
+        for part in pipeline.parts('dataset', key):
+            metadata = pq.ParquetFile(part).metadata
+            column = metadata.schema.names.index('PY')
+            for row_group in range(metadata.num_row_groups):
+                statistics = metadata.row_group(row_group).column(column).statistics
+                year = statistics.min if statistics is not None and statistics.has_min_max else None
+                years.setdefault(year, []).append((batch, part, row_group))
+    years = sorted(years.items(), key=lambda item: (item[0] is None, item[0] or 0))
+    temp_dir = f'{output_path}.{os.getpid()}.tmp.d'
+    os.makedirs(temp_dir)
+    year_paths = [os.path.join(temp_dir, part_path('', index)) for index in range(len(years))]
+    summaries = pipeline.map(
+        deduplicate_year, [(row_groups, path) for (_year, row_groups), path in zip(years, year_paths)])
+    categories = {column: sorted(set().union(*(summary[1][column] for summary in summaries)))
+                  for column in CATEGORY_COLUMNS}
+    dtypes = {column: np.result_type(*(summary[2][column] for summary in summaries)) for column in summaries[0][2]}
+
+    temp_path = f'{output_path}.{os.getpid()}.tmp'
+    writer = None
+    for path in year_paths:
+        dataset = pd.read_parquet(path)
+        if csv_path:
+            dataset.to_csv(csv_path, index=False, header=writer is None, mode='a' if writer else 'w')
+        dataset = dataset.astype(dtypes)
+        for column in CATEGORY_COLUMNS:
+            dataset[column] = pd.Categorical(dataset[column], categories=categories[column])
+        table = pa.Table.from_pandas(dataset, preserve_index=False)
+        if writer is None:
+            # Parquet is compressed and keeps the data types
+            writer = pq.ParquetWriter(temp_path, table.schema, compression='gzip')
+        writer.write_table(table)
+    writer.close()
+    os.replace(temp_path, output_path)
+    shutil.rmtree(temp_dir)
+    return sum(summary[0] for summary in summaries)
+
+
+# --- PIPELINE ---
+def file_digest(path):
+    """Hash the content of an export, the stages which read it are keyed by this hash."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def part_path(directory, index):
+    """Return the path of a part of an output, the parts are in the order of their names."""
+    return os.path.join(directory, f'part-{index:05d}.parquet')
+
+
+def num_parquet_rows(path):
+    """Return the number of rows of the parquet file from its metadata."""
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+class Pipeline:
+    """Stages of the ETL, their outputs are cached in a directory by the stage and the hash of its inputs.
+
+    The outputs are directories of parquet parts, the chunks of the exports are processed by a pool of processes.
+    """
+
+    def __init__(self, cache_dir, workers, chunk_rows):
+        """Use the cache directory, it is created with the first output."""
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+
+    def path(self, stage, key):
+        """Return the directory of the output of the stage."""
+        return os.path.join(self.cache_dir, f'{stage}-{key}')
+
+    def run(self, stage, inputs, compute):
+        """Return the key of the output of the stage, it is only computed if the cache does not have it yet.
+
+        compute writes the output to the directory it gets and returns its number of rows.
+        """
+        key = hashlib.sha1(json.dumps([stage, STAGE_VERSIONS[stage], inputs]).encode()).hexdigest()[:16]
+        path = self.path(stage, key)
+        if os.path.isdir(path):
+            print(f'{stage}: cached')
+            return key
+        start = time.perf_counter()
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        num_rows = compute(temp_path)
+        os.replace(temp_path, path)
+        print(f'{stage}: {num_rows} rows in {time.perf_counter() - start:.1f} s')
+        return key
+
+    def parts(self, stage, key):
+        """Return the paths of the parts of the output of the stage in their order."""
+        return sorted(glob.glob(os.path.join(self.path(stage, key), '*.parquet')))
+
+    def load(self, stage, key, columns=None):
+        """Read the output of the stage."""
+        return pd.concat(
+            [pd.read_parquet(part, columns=columns) for part in self.parts(stage, key)], ignore_index=True)
+
+    def map(self, function, argument_lists, initializer=None, initargs=()):
+        """Call the function with each of the arguments in the worker processes and return the results in order.
+
+        At most twice as many calls as workers are pending, so arguments which are produced lazily, like the chunks of
+        an export, are only read as fast as they are processed.
+        """
+        results = []
+        with ProcessPoolExecutor(self.workers, initializer=initializer, initargs=initargs) as executor:
+            pending = collections.deque()
+            for arguments in argument_lists:
+                pending.append(executor.submit(function, *arguments))
+                if len(pending) >= 2 * self.workers:
+                    results.append(pending.popleft().result())
+            results.extend(future.result() for future in pending)
+        return results
+
+
+def read_manifest(cache_dir):
+    """Return the batches of exports, pairs of papers and countries, of the last build."""
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return [tuple(batch) for batch in json.load(file)['batches']]
+
+
+def write_manifest(cache_dir, batches):
+    """Remember the batches of exports of the build."""
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, MANIFEST_NAME), 'w') as file:
+        json.dump({'batches': [list(batch) for batch in batches]}, file, indent=2)
+
+
+def classify_batch(pipeline, affiliations_key, vocabulary_keys, directory):
+    """Classify the papers of the batch with the vocabularies of the batches up to it, part by part.
+
+    The organisations of all papers are searched first, so that each vocabulary is scanned once for the batch.
+    """
+    vocabularies = read_vocabularies(pipeline, vocabulary_keys)
+    parts = pipeline.parts('affiliations', affiliations_key)
+    names = {'Company': set(), 'Academia': set()}
+    for part in parts:
+        affiliations = pd.read_parquet(part, columns=['C1', 'C2', 'Academic'])
+        academic = affiliations['Academic'].to_numpy()
+        names['Company'].update(searched_names(affiliations[~academic]))
+        names['Academia'].update(searched_names(affiliations[academic]))
+    for label, vocabulary in vocabularies.items():
+        vocabulary.search(names[label])
+    return sum(pipeline.map(
+        classify_part,
+        [(part, os.path.join(directory, os.path.basename(part))) for part in parts],
+        initializer=set_vocabularies,
+        initargs=(vocabularies,)
+    ))
+
+
+def run_stages(pipeline, batches):
+    """Run the stages of all batches of exports and return the keys of their outputs by batch."""
+    batch_keys = []
+    for papers_path, countries_path in batches:
+        print(f'batch {papers_path}, {countries_path}')
+        earlier_keys = [keys['affiliations'] for keys in batch_keys]
+        earlier_digests = (
+            digest for key in earlier_keys for digest in pipeline.load('affiliations', key, ['ABDigest'])['ABDigest'])
+        keys = {'affiliations': pipeline.run(
+            'affiliations', [file_digest(papers_path), earlier_keys],
+            lambda directory: read_papers(pipeline, papers_path, earlier_digests, directory)
+        )}
+        keys['vocabulary'] = [*earlier_keys, keys['affiliations']]
+        keys['organisations'] = pipeline.run('organisations', keys['vocabulary'], lambda directory: classify_batch(
+            pipeline, keys['affiliations'], keys['vocabulary'], directory))
+        keys['countries'] = pipeline.run('countries', [file_digest(countries_path)], lambda directory: read_countries(
+            pipeline, countries_path, directory))
+        keys['dataset'] = pipeline.run('dataset', [keys['organisations'], keys['countries']], lambda directory: combine(
+            pipeline, pipeline.parts('organisations', keys['organisations']),
+            pipeline.parts('countries', keys['countries']), directory))
+        batch_keys.append(keys)
+    return batch_keys
+
+
+def build(batches, output_path=OUTPUT_PATH, cache_dir=CACHE_DIR, csv_path=None, workers=os.cpu_count(),
+          chunk_rows=CHUNK_ROWS):
+    """Run the stages of all batches of exports and write the dataset, only stages with new inputs are computed."""
+    pipeline = Pipeline(cache_dir, workers, chunk_rows)
+    batch_keys = run_stages(pipeline, batches)
+    num_rows = write_dataset(pipeline, [keys['dataset'] for keys in batch_keys], output_path, csv_path)
+    write_manifest(cache_dir, batches)
+    print(f'wrote {num_rows} rows of {len(batches)} batches to {output_path}')
+
+
+def check_labels(cache_dir=CACHE_DIR, sample=1000, seed=0, workers=os.cpu_count(), chunk_rows=CHUNK_ROWS):
+    """Compare the organisations of a sample of papers of the last build to the quadratic classification.
+
+    Return whether all of them are equal.
+    """
+    pipeline = Pipeline(cache_dir, workers, chunk_rows)
+    num_papers = 0
+    num_differences = 0
+    for keys in run_stages(pipeline, read_manifest(cache_dir)):
+        affiliations = pipeline.load('affiliations', keys['affiliations'])
+        if sample and sample < len(affiliations):
+            affiliations = affiliations.sample(sample, random_state=seed)
+        vocabularies = read_vocabularies(pipeline, keys['vocabulary'])
+        labels = classify_organisations(affiliations, vocabularies)['Organisation']
+        expected = classify_organisations(affiliations, vocabularies, label_organisations_quadratic)['Organisation']
+        different = (labels != expected).to_numpy()
+        differences = affiliations[different].assign(Organisation=labels[different], Expected=expected[different])
+        for paper in differences.itertuples():
+            print(f'{paper.UT} {paper.C1!r} {paper.C2!r}: {paper.Organisation} instead of {paper.Expected}')
+        num_papers += len(affiliations)
+        num_differences += len(differences)
+    print(f'checked {num_papers} papers, {num_differences} differ')
+    return num_differences == 0
+
+
+def write_reports(path=OUTPUT_PATH):
+    """Create the pandas-profiling and Sweetviz reports of the dataset."""
+    # https://github.com/pandas-profiling/pandas-profiling and https://github.com/fbdesignpro/sweetviz
+    from pandas_profiling import ProfileReport
+    import sweetviz
+    dataset = pd.read_parquet(path)
+    ProfileReport(dataset, title='Papers - Pandas Profiling Report').to_file('papers_pandas-profiling-report.html')
+    sweetviz.analyze(dataset).show_html(filepath='papers_sweetviz-report.html', open_browser=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', default=OUTPUT_PATH, help='path of the dataset')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='directory of the outputs of the stages')
+    parser.add_argument('--csv', help='also write the dataset to this CSV file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='rows of the exports processed at once')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='process the batches of exports')
+    build_parser.add_argument('--papers', nargs='+', default=[PAPERS_PATH], help='papers of each batch')
+    build_parser.add_argument('--countries', nargs='+', default=[COUNTRIES_PATH], help='countries of each batch')
+    append_parser = subparsers.add_parser('append', help='add a batch of exports to the last build')
+    append_parser.add_argument('papers', help='papers of the batch')
+    append_parser.add_argument('countries', help='countries of the batch')
+    check_parser = subparsers.add_parser('check-labels', help='compare the organisations to the old classification')
+    check_parser.add_argument('--sample', type=int, default=1000, help='number of papers per batch, 0 for all')
+    subparsers.add_parser('reports', help='create the profiling reports of the dataset')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if len(args.papers) != len(args.countries):
+            parser.error('every batch needs papers and countries')
+        build(list(zip(args.papers, args.countries)), args.output, args.cache_dir, args.csv, args.workers,
+              args.chunk_rows)
+    elif args.command == 'append':
+        batches = read_manifest(args.cache_dir)
+        if not batches:
+            parser.error(f'no build in {args.cache_dir}, run build first')
+        if (args.papers, args.countries) in batches:
+            print(f'{args.papers} and {args.countries} are already in {args.output}')
+        else:
+            build([*batches, (args.papers, args.countries)], args.output, args.cache_dir, args.csv, args.workers,
+                  args.chunk_rows)
+    elif args.command == 'check-labels':
+        if not check_labels(args.cache_dir, args.sample, workers=args.workers, chunk_rows=args.chunk_rows):
+            sys.exit(1)
+    else:
+        write_reports(args.output)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Define the figure templates of the Dash application."""
+
+import threading
+
+from dash import Patch
+
+
+class FigureTemplate:
+    """Skeleton of a figure which is built once, per request only the data of its traces is swapped in.
+
+    The skeleton holds everything plotly.express derives from the arguments of a chart: the traces, their colours,
+    the labels, the layout and the geos settings. Rendering copies the traces shallowly and shares the layout,
+    so the rendered figures must not be modified.
+    """
+
+    def __init__(self, build, data_keys):
+        """Remember the function which builds the skeleton figure, it is only called on the first use."""
+        self._build = build
+        self._figure = None
+        self._lock = threading.Lock()
+        # Keys of the traces which are replaced when rendering, everything else is part of the skeleton
+        self.data_keys = data_keys
+
+    @property
+    def figure(self):
+        """Return the skeleton as a plotly JSON dict, callers wait while another thread builds it."""
+        with self._lock:
+            if self._figure is None:
+                self._figure = self._build().to_plotly_json()
+        return self._figure
+
+    @property
+    def traces(self):
+        """Return the traces of the skeleton."""
+        return self.figure['data']
+
+    def render(self, trace_data):
+        """Return a new figure with the data of each trace replaced by the dict of the same position."""
+        return {
+            'data': [
+                {**trace, **{key: data[key] for key in self.data_keys}}
+                for trace, data in zip(self.traces, trace_data)
+            ],
+            'layout': self.figure['layout']
+        }
+
+    def patch(self, figure):
+        """Return a partial update which only replaces the trace data of a figure rendered from this template.
+
+        The client applies it to the figure it already shows, so that the layout is not sent again.
+        """
+        patch = Patch()
+        for index, trace in enumerate(figure['data']):
+            for key in self.data_keys:
+                patch['data'][index][key] = trace[key]
+        return patch
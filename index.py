@@ -4,6 +4,9 @@
 # Run this app with `python index.py` and
 # visit http://127.0.0.1:8050/ in your web browser.
 
+import copy
+import functools
+
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
@@ -12,26 +15,55 @@ from dash.dependencies import Input, Output
 from app import app, server
 from layouts import analyses_layout, dataset_layout, description_layout
 import callbacks
+import metrics
 
 app.layout = html.Div([
         dcc.Location(id='url', refresh=False),
         html.Div(id='page-content')
 ])
 
+# Load the dataset and compute the default charts in the background, the layout can be served right away
+callbacks.start_warm_up()
+
+
+# Serve /metrics and record the response sizes, if enabled
+metrics.instrument(server)
+
+
+@server.route('/ready')
+def ready():
+    """Answer readiness checks once the dataset is loaded and the default charts are cached."""
+    if callbacks.warmed_up.is_set():
+        return 'ready'
+    return 'warming up', 503
+
+
+@functools.lru_cache(maxsize=None)
+def analyses_page():
+    """Return a copy of the analyses layout showing the charts of the default filter, which need no callbacks.
+
+    A page requested during the warm-up waits for its snapshot instead of computing it again.
+    """
+    page = copy.deepcopy(analyses_layout)
+    for component_id, properties in callbacks.default_snapshot().items():
+        for name, value in properties.items():
+            setattr(page[component_id], name, value)
+    return page
+
 
 @app.callback(Output('page-content', 'children'),
               Input('url', 'pathname'))
 def display_page(pathname):
     """Route to the desired page."""
     if pathname == '/':
-        return analyses_layout
+        return analyses_page()
     elif pathname == '/dataset':
         return dataset_layout
     elif pathname == '/description':
         return description_layout
     else:
         # the default
-        return analyses_layout
+        return analyses_page()
 
 
 # Run the application, if this python file is executed
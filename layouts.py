@@ -6,16 +6,15 @@ import dash_html_components as html
 import random
 
 # Local import of the text strings
-from app import df
 from constants import (LOADING_TYPE, COLOR_MAP, LABELS, RESEARCH_CATEGORIES, PANDASPROFILING_REPORT,
                        SWEETVIZ_REPORT, HEADER_INTRO_TXT, DATASET_FEATURES_TXT, PROJECT_DESCRIPTION_TXT)
+from data_access import dataset_year_range
 
 
 # --- CALCULATIONS ---
 
-# Publication year range
-py_min = int(df['PY'].min())
-py_max = int(df['PY'].max())
+# Publication year range, read from the metadata of the dataset, so that the layout is ready before the dataset
+py_min, py_max = (int(year) for year in dataset_year_range())
 # This adds three dicts together to describe the markers of the year range:
 # There is marker every year with an empty label,
 # every five years there is a marker with the year as label
@@ -106,21 +105,17 @@ analyses_layout = html.Div([
                             min=py_min,
                             max=py_max,
                             value=[py_min, py_max],
+                            # The charts follow the slider while it is dragged
+                            updatemode='drag',
                             className='dcc_control'
+                        ),
+                        # Filter of the charts, set once the controls did not change for a moment
+                        dcc.Store(
+                            id='filter-state'
                         )
                     ],
-                    className='seven columns'
-                ),
-                html.Div([
-                        html.Button(
-                            id='submit-button-state',
-                            n_clicks=0,
-                            children='Update Charts',
-                            className='button'
-                        )
-                    ],
-                    className='two columns item-column'
-                ),
+                    className='nine columns'
+                )
             ],
             className='row flex-display pretty_container padded'
         ),
@@ -194,6 +189,10 @@ analyses_layout = html.Div([
                 html.Div(
                     id='map-data',
                     style={'display': 'none'}
+                ),
+                # Counts which the browser filters itself, only filled with CLIENTSIDE_FILTERING
+                dcc.Store(
+                    id='count-store'
                 )
             ],
             className='row'
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Define the metrics of the Dash application, exposed in the Prometheus text format."""
+
+# Set METRICS=1 to measure the instrumented functions and to serve the metrics at /metrics.
+# Without it the decorators return the functions unchanged, so the metrics cost nothing.
+# Every (gunicorn) worker process has its own metrics, so each scrape only sees the worker which answers it.
+
+import bisect
+import functools
+import threading
+import time
+
+from constants import METRICS_ENABLED
+
+# Upper bounds of the buckets of the histograms
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+ROW_BUCKETS = tuple(10 ** exponent for exponent in range(8))
+BYTE_BUCKETS = tuple(4 ** exponent for exponent in range(4, 14))
+
+
+class Histogram:
+    """Histogram with one label, its values are counted in cumulative buckets like Prometheus does."""
+
+    def __init__(self, name, documentation, label, buckets):
+        """Create a histogram without observations."""
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = buckets
+        # Map the label values to the counts of the buckets (plus +Inf), the sum and the count
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        """Count the value in the first bucket whose upper bound is not below it."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(label_value, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def exposition(self):
+        """Return the lines of the histogram in the Prometheus text format."""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {label_value: (list(counts), total, count)
+                      for label_value, (counts, total, count) in self._series.items()}
+        for label_value, (counts, total, count) in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, bucket_count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+span_seconds = Histogram(
+    'dashboard_span_seconds', 'Duration of the instrumented functions.', 'span', DURATION_BUCKETS)
+rows = Histogram(
+    'dashboard_rows', 'Number of papers selected by a filter.', 'span', ROW_BUCKETS)
+response_bytes = Histogram(
+    'dashboard_response_bytes', 'Size of the responses by route, Dash callbacks by their outputs.', 'endpoint',
+    BYTE_BUCKETS)
+HISTOGRAMS = [span_seconds, rows, response_bytes]
+
+
+def span(function):
+    """Measure the duration of every call of the function, if the metrics are enabled."""
+    if not METRICS_ENABLED:
+        return function
+
+    @functools.wraps(function)
+    def measured(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            span_seconds.observe(function.__name__, time.perf_counter() - start)
+    return measured
+
+
+def observe_rows(name, num_rows):
+    """Record the number of papers selected in a span, if the metrics are enabled."""
+    if METRICS_ENABLED:
+        rows.observe(name, num_rows)
+
+
+def exposition():
+    """Return all metrics in the Prometheus text format."""
+    return '\n'.join(line for histogram in HISTOGRAMS for line in histogram.exposition()) + '\n'
+
+
+def instrument(server):
+    """Record the size of the responses of the Flask server and serve the metrics, if the metrics are enabled."""
+    if not METRICS_ENABLED:
+        return
+    from flask import request
+
+    def endpoint():
+        """Return the outputs of a Dash callback or else the route of the request, both are few label values."""
+        if request.url_rule is None:
+            return 'unmatched'
+        if request.url_rule.rule.endswith('/_dash-update-component'):
+            # Dash already parsed the body, get_json returns it from its cache
+            body = request.get_json(silent=True)
+            if isinstance(body, dict) and isinstance(body.get('output'), str):
+                return body['output']
+        return request.url_rule.rule
+
+    @server.after_request
+    def record_response(response):
+        """Record the size of the response by its endpoint."""
+        if response.content_length is not None:
+            response_bytes.observe(endpoint(), response.content_length)
+        return response
+
+    @server.route('/metrics')
+    def serve_metrics():
+        """Serve the metrics to Prometheus."""
+        return exposition(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
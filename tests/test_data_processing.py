@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Test the classification of the organisations in dataset/data_processing.py."""
+
+# Run `python -m pytest tests` in the root directory of the repository.
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dataset'))
+import data_processing  # noqa: E402
+
+# Affiliations of papers like in the C1 column of the exports: companies alone and with others, academia alone and
+# with others, second organisations which are parts of names or span two joined names, and missing ones
+AFFILIATIONS = [
+    '[Smith, J.] Google Inc, Mountain View, CA; [Doe, A.] Stanford Univ, Dept Comp Sci, Stanford, CA',
+    'Google Inc, Mountain View, CA; Google, Zurich, Switzerland',
+    'Google Inc, Mountain View, CA; Siemens AG, Munich, Germany',
+    'Siemens AG, Munich, Germany; Siemens, Erlangen, Germany',
+    'Siemens AG, Munich, Germany; AG Google, Berlin, Germany',
+    'Siemens AG, Munich, Germany; Bosch GmbH, Stuttgart, Germany',
+    'IBM Corp, Armonk, NY; IBM Res, Zurich, Switzerland',
+    'Bosch GmbH, Stuttgart, Germany',
+    'Stanford Univ, Stanford, CA; Massachusetts Inst Technol, Cambridge, MA',
+    'Massachusetts Inst Technol, Cambridge, MA; Technol, Cambridge, MA',
+    'Karlsruhe Inst Technol, Karlsruhe, Germany; Univ Strasbourg, Strasbourg, France',
+    'Univ Strasbourg, Strasbourg, France; Strasbourg, France',
+    'Univ Strasbourg, Strasbourg, France; Google Inc, Paris, France',
+    'Univ Strasbourg, Strasbourg, France; University Karlsruhe, Karlsruhe, Germany',
+    '(Doe, A.) Massachusetts Inst Technol, Cambridge, MA',
+    'Stanford Univ, Stanford, CA; ',
+]
+
+
+def affiliations_frame():
+    """Return the normalised affiliations of the papers with the columns of the papers."""
+    first, second, academic = data_processing.AffiliationNormaliser().normalise(np.array(AFFILIATIONS, dtype=object))
+    papers = pd.DataFrame({column: np.arange(len(AFFILIATIONS)) for column in data_processing.PAPER_COLUMNS})
+    return papers.assign(C1=first.copy(), C2=second.copy(), Academic=academic.copy())
+
+
+def classify(affiliations, label_function):
+    """Return the organisations of the papers, with vocabularies of the first organisations like the pipeline."""
+    first = affiliations['C1'].to_numpy()
+    academic = affiliations['Academic'].to_numpy()
+    vocabularies = {
+        'Company': data_processing.Vocabulary(pd.unique(first[~academic])),
+        'Academia': data_processing.Vocabulary(pd.unique(first[academic]))
+    }
+    return data_processing.classify_organisations(affiliations, vocabularies, label_function)['Organisation'].tolist()
+
+
+def test_labels_equal_quadratic_classification():
+    affiliations = affiliations_frame()
+    labels = classify(affiliations, data_processing.label_organisations)
+    assert labels == classify(affiliations, data_processing.label_organisations_quadratic)
+    # The fixture covers every label
+    assert set(labels) == {'Company', 'Academia', 'Collaboration'}
+
+
+def test_vocabulary_finds_names_in_joined_names():
+    vocabulary = data_processing.Vocabulary(['Google Inc', 'Siemens AG', 'IBM Corp'])
+    for name in ['Google Inc', 'Siemens', 'AG IBM', 'Inc Siemens AG', 'oogl', '']:
+        assert name in vocabulary
+    for name in ['Bosch GmbH', 'Google Inc Siemens AG IBM Corp ', 'IBM Corp Google']:
+        assert name not in vocabulary
+
+
+def test_occurring_names_equal_substring_search():
+    generator = np.random.default_rng(0)
+    for _ in range(200):
+        text = ''.join(generator.choice(list('ab '), generator.integers(0, 30)))
+        names = {''.join(generator.choice(list('ab '), generator.integers(0, 5))) for _ in range(10)}
+        assert data_processing.occurring_names(names, text) == {name for name in names if name in text}